@@ -10,7 +10,7 @@ client = openai.AsyncOpenAI(api_key=config['API_KEY'])
 
 async def check_topic(post, id, topics):
 
-    prompt = f"Is the following post relevant to any of these topics: {config['topics']}? Answer only True or False.\n\nPost: {post['post_text']}"
+    prompt = f"Is the following post relevant to any of these topics: {topics}? Answer only True or False.\n\nPost: {post['post_text']}"
 
     messages = [{"role": "user", "content": prompt}]
     response = await client.chat.completions.create(
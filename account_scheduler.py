@@ -0,0 +1,74 @@
+import asyncio
+
+import metrics
+from adaptive_limit import AdaptiveLimiter
+from page_pool import PagePool
+
+# Outcomes after which a job is retried on another account
+MOVE_OUTCOMES = ('throttled', 'authwall')
+
+
+class AccountScheduler:
+    # Runs scrape jobs on all logged in accounts at once, each with its own
+    # page pool and adaptive limit. Jobs wait here until some account has a
+    # free slot under its current concurrency limit, then go to the one with
+    # the least pending work per remaining use. Accounts with more quota take
+    # a bigger share, one that got slowed down stops taking work. A throttled
+    # job moves to another account, an authwall takes the account out of the
+    # rotation (its cookies stopped working).
+
+    def __init__(self, browser, quotas, pool_options={}, limit_options={}):
+        self.accounts = {}
+        for name, remaining in quotas.items():
+            limiter = AdaptiveLimiter(name, **limit_options)
+            # A page for every slot the limit can grow to
+            self.accounts[name] = {'name': name, 'remaining': remaining, 'pending': 0, 'disabled': False,
+                                   'pool': PagePool(browser, name, int(limiter.max_concurrency), **pool_options),
+                                   'limiter': limiter}
+        self.changed = asyncio.Condition()
+
+    def remaining(self):
+        return sum(account['remaining'] for account in self.accounts.values() if not account['disabled'])
+
+    def usable(self, exclude=()):
+        return [account for account in self.accounts.values()
+                if account['remaining'] > 0 and not account['disabled'] and account['name'] not in exclude]
+
+    def pick(self, exclude=()):
+        free = [account for account in self.usable(exclude)
+                if account['pending'] < int(account['limiter'].concurrency)]
+        if not free:
+            return None
+        return min(free, key=lambda account: ((account['pending'] + 1) / account['remaining'], -account['remaining']))
+
+    async def run(self, scrape, *args):
+        # scrape(pool, limiter, *args) returns a dict with an 'outcome', None
+        # when no account had uses left
+        tried = set()
+        result = None
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.pick(tried) or not self.usable(tried))
+                account = self.pick(tried)
+                if account is None:
+                    return result
+                account['remaining'] -= 1
+                account['pending'] += 1
+            try:
+                result = await scrape(account['pool'], account['limiter'], *args)
+            finally:
+                async with self.changed:
+                    account['pending'] -= 1
+                    self.changed.notify_all()
+            metrics.record(f"jobs[{account['name']}]", 1)
+            if result['outcome'] not in MOVE_OUTCOMES:
+                return result
+
+            print(f"Moving job off {account['name']} ({result['outcome']})")
+            if result['outcome'] == 'authwall':
+                account['disabled'] = True
+            tried.add(account['name'])
+
+    async def close(self):
+        for account in self.accounts.values():
+            await account['pool'].close()
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import metrics
+
+# LinkedIn answers throttled requests with 429 or its own 999
+THROTTLE_STATUSES = (429, 999)
+AUTHWALL_PARTS = ('/authwall', '/checkpoint', '/login', '/uas/login')
+
+
+def page_outcome(response, url):
+    # What a page load tells the limiter, 'ok' unless LinkedIn pushed back
+    if response is not None and response.status in THROTTLE_STATUSES:
+        return 'throttled'
+    # Whole path segments only, /in/loginov-ivan is a profile
+    path = urlparse(url).path
+    if any(path == part or path.startswith(part + '/') for part in AUTHWALL_PARTS):
+        return 'authwall'
+    return 'ok'
+
+
+class AdaptiveLimiter:
+    # AIMD limit for one account. Every successful request adds 1/concurrency
+    # to the concurrency (so about one more slot per full window) and takes
+    # interval_step off the spacing between request starts. A throttled
+    # request, an authwall redirect, an extraction failure or a page slower
+    # than slow_latency multiplies the concurrency by backoff and divides the
+    # spacing by it. Requests started before the last decrease don't cut
+    # again, a burst of 429s counts as one signal.
+
+    def __init__(self, name, concurrency=2, min_concurrency=1, max_concurrency=6,
+                 interval=5, min_interval=1, max_interval=120, interval_step=0.5,
+                 slow_latency=20, backoff=0.5):
+        self.name = name
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval_step = interval_step
+        self.slow_latency = slow_latency
+        self.backoff = backoff
+        self.in_flight = 0
+        self.next_start = 0
+        self.last_decrease = 0
+        self.changed = asyncio.Condition()
+        self.publish()
+
+    def publish(self):
+        metrics.set_gauge(f'concurrency_limit[{self.name}]', round(self.concurrency, 2))
+        metrics.set_gauge(f'request_interval[{self.name}]', round(self.interval, 2))
+
+    async def acquire(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        # Space out the starts, the slot is reserved before sleeping
+        now = time.monotonic()
+        start = max(now, self.next_start)
+        self.next_start = start + self.interval
+        await asyncio.sleep(start - now)
+        return start
+
+    async def release(self, started, outcome, latency):
+        metrics.record('request_latency', latency)
+        if outcome == 'ok' and latency > self.slow_latency:
+            outcome = 'slow'
+        metrics.record(f'requests_{outcome}', 1)
+
+        async with self.changed:
+            self.in_flight -= 1
+            if outcome == 'ok':
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.interval = max(self.min_interval, self.interval - self.interval_step)
+            elif started >= self.last_decrease:
+                print(f"{self.name}: {outcome}, backing off")
+                self.last_decrease = time.monotonic()
+                self.concurrency = max(self.min_concurrency, self.concurrency * self.backoff)
+                self.interval = min(self.max_interval, self.interval / self.backoff)
+                self.next_start = max(self.next_start, self.last_decrease + self.interval)
+            self.publish()
+            self.changed.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        # The caller sets result['outcome'] (and result['latency'] for the
+        # page load alone), an exception counts as a failed extraction
+        started = await self.acquire()
+        result = {'outcome': 'ok', 'latency': None}
+        try:
+            yield result
+        except BaseException:
+            if result['outcome'] == 'ok':
+                result['outcome'] = 'failed'
+            raise
+        finally:
+            latency = result['latency']
+            if latency is None:
+                latency = time.monotonic() - started
+            await self.release(started, result['outcome'], latency)
@@ -0,0 +1,494 @@
+import argparse
+import asyncio
+import contextlib
+import glob
+import itertools
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from job_queue import JobQueue
+
+from scrape_functions import (parse_posts, parse_posts_person, PARSER_BACKENDS, extract_posts_person,
+                              parse_voyager_updates, fetch_posts, fetch_posts_person, set_parse_workers)
+import metrics
+
+# Offline benchmark suite: parsing, dedupe/storage, find_missing_people, near
+# duplicate lookups and /load_data paging, plus the parser parity checks.
+# Results are seconds per operation and get compared with
+# benchmark_baseline.json, anything more than the threshold slower than its
+# baseline counts as a regression.
+# pom.html holds a single post, it gets repeated (with a unique opening line
+# so saved_keys doesn't drop the copies) to look like a loaded activity page.
+
+POSTS_PER_PAGE = 50
+MIN_SECONDS = 2
+BASELINE_FILE = 'benchmark_baseline.json'
+REGRESSION_THRESHOLD = 0.5
+# Single worst case samples (a few ms with parse workers) swing by more
+# than the threshold between runs of the same code. They only count as a
+# regression when they're also this many seconds over the baseline, a
+# parse back on the event loop stalls it for seconds.
+ABSOLUTE_TOLERANCE = {'loop lag max': 0.05}
+KEY_SIZES = (10_000, 100_000, 1_000_000)
+POST_SIZES = (10_000, 100_000)
+PEOPLE_SIZES = (1_000, 5_000)
+FEED_SIZES = (1_000, 10_000, 100_000)
+NEAR_DUPE_SIZES = (10_000, 100_000)
+LAG_PARSE_WORKERS = (0, 2)
+LAG_PAGES = 8
+FARM_WORKERS = (1, 2, 4)
+FARM_PROFILES = 40
+
+
+def load_fixture(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def synthetic_urn(prefix, i):
+    # Different pages get different urns, the watermarks rely on that
+    return 7300000000000000000 + zlib.crc32(prefix.encode()) * 10000 + i
+
+
+def make_person_page(post_html, count=POSTS_PER_PAGE, prefix=''):
+    items = []
+    for i in range(count):
+        body = post_html.replace('<span dir="ltr"><!---->',
+                                 f'<span dir="ltr"><!---->{prefix}{i} ', 1)
+        items.append(
+            f'<li><div class="feed-shared-update-v2" data-urn="urn:li:activity:{synthetic_urn(prefix, i)}">'
+            f'{body}</div></li>')
+    return ''.join(items)
+
+
+def make_feed_page(post_html, count=POSTS_PER_PAGE, prefix=''):
+    items = []
+    for i in range(count):
+        body = post_html.replace('<span dir="ltr"><!---->',
+                                 f'<span dir="ltr"><!---->{prefix}{i} ', 1)
+        items.append(
+            f'<div data-finite-scroll-hotkey-item="{i}" data-id="urn:li:activity:{synthetic_urn(prefix, i)}">'
+            f'{body}</div>')
+    return ''.join(items)
+
+
+def build_pages():
+    post_html = load_fixture('pom.html')
+    pages = [
+        ('pom.html (activity)', parse_posts_person, make_person_page(post_html)),
+        ('pom.html (feed)', parse_posts, make_feed_page(post_html)),
+    ]
+    for path in sorted(glob.glob('saved_feeds/*.html')):
+        pages.append((path, parse_posts, load_fixture(path)))
+    return pages
+
+
+def measure(fn, setup=None, min_seconds=MIN_SECONDS):
+    # Fastest call of fn over at least min_seconds (the minimum is the least
+    # noisy number to compare runs with), setup runs before every call untimed
+    timings = []
+    while not timings or sum(timings) < min_seconds:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@contextlib.contextmanager
+def in_temp_dir():
+    # The storage code works on paths relative to the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            yield folder
+        finally:
+            os.chdir(cwd)
+
+
+def random_key(length=35):
+    return ''.join(random.choices(string.ascii_letters + string.digits + ' ', k=length))
+
+
+def synthetic_post(i):
+    return {'profile_link': f'https://www.linkedin.com/in/person{i % 500}', 'embeding_url': f'urn:li:activity:{7300000000000000000 + i}',
+            'post_text': random_key(200), 'data_id': random_key(), 'id': i, 'name': 'Bench Person',
+            'rank': '', 'description': 'Benchmarks', 'time_posted': '1d •'}
+
+
+def bench_parsing(min_seconds):
+    results = {}
+    backends = {name: backend() for name, backend in PARSER_BACKENDS.items()}
+    for name, parse, html in build_pages():
+        for backend_name, backend in backends.items():
+            results[f'parse {name} [{backend_name}]'] = measure(
+                lambda: parse(html, set(), [], backend), min_seconds=min_seconds)
+    return results
+
+
+class FixturePage:
+    # Just enough of a playwright page for fetch_posts / fetch_posts_person
+    # without scrolling, inner_html and the html extractor hand back the
+    # fixture
+    url = 'fixture'
+
+    def __init__(self, html):
+        self.html = html
+        self.first = self
+
+    async def inner_html(self, selector=None, timeout=None):
+        # Hand the loop back like a real page call would
+        await asyncio.sleep(0)
+        return self.html
+
+    def locator(self, selector):
+        return self
+
+    async def evaluate(self, script, options, timeout=None):
+        await asyncio.sleep(0)
+        # The whole fixture is new on the first call, nextId only matters
+        # after a scroll
+        html = self.html if not options['start'] else ''
+        return {'html': html, 'items': self.html.count('<li>'), 'nextId': options['firstId']}
+
+
+async def collect_person_posts(page):
+    return [post async for post in fetch_posts_person(page, 'bench', 'all', set(), max_scrolls=0)]
+
+
+def bench_fetching(min_seconds):
+    post_html = load_fixture('pom.html')
+    person_page = FixturePage(make_person_page(post_html))
+    feed_page = FixturePage(make_feed_page(post_html))
+    return {
+        'fetch_posts pom.html (feed)': measure(
+            lambda: asyncio.run(fetch_posts(feed_page, set())), min_seconds=min_seconds),
+        'fetch_posts_person pom.html (activity)': measure(
+            lambda: asyncio.run(collect_person_posts(person_page)), min_seconds=min_seconds),
+    }
+
+
+def bench_loop_lag(worker_counts, pages=LAG_PAGES):
+    # Worst event loop stall while several activity pages get parsed at
+    # once, parsing on the loop against parsing in the parse pool
+    post_html = load_fixture('pom.html')
+    fixture_pages = [FixturePage(make_person_page(post_html, prefix=f'{i} ')) for i in range(pages)]
+
+    async def fetch_all():
+        watch = asyncio.create_task(metrics.watch_loop_lag(0.01))
+        start = time.perf_counter()
+        await asyncio.gather(*[collect_person_posts(page) for page in fixture_pages])
+        elapsed = time.perf_counter() - start
+        # Let the watcher see the last stall
+        await asyncio.sleep(0.05)
+        watch.cancel()
+        return elapsed
+
+    results = {}
+    for workers in worker_counts:
+        set_parse_workers(workers)
+        # The first round starts the pool processes
+        asyncio.run(fetch_all())
+        metrics.reset()
+        elapsed = asyncio.run(fetch_all())
+        label = f'{workers} parse workers' if workers else 'parsing on the loop'
+        results[f'loop lag max, {pages} activity pages [{label}]'] = max(metrics.samples['loop_lag'])
+        results[f'fetch {pages} activity pages [{label}]'] = elapsed
+    set_parse_workers(0)
+    return results
+
+
+def bench_storage(key_sizes, post_sizes, min_seconds):
+    from post_store import PostStore, post_urn
+    from seen_posts import SeenPosts
+
+    results = {}
+    with in_temp_dir():
+        for size in key_sizes:
+            for file_name in glob.glob('seen_posts.db*'):
+                os.remove(file_name)
+            keys = [random_key() for _ in range(size)]
+            seen_posts = SeenPosts()
+            for key in keys:
+                seen_posts.add(key)
+            seen_posts.close()
+            results[f'open seen posts {size}'] = measure(
+                lambda: SeenPosts().db.close(), min_seconds=min_seconds)
+            # The dedupe check on every scraped post, one in ten seen before
+            seen_posts = SeenPosts()
+            posts = [{'embeding_url': keys[i] if i % 10 == 0 else random_key()} for i in range(1000)]
+            results[f'check 1000 posts against {size} seen keys'] = measure(
+                lambda: [post for post in posts if post_urn(post) not in seen_posts], min_seconds=min_seconds)
+            batches = itertools.count()
+
+            def record_new_posts():
+                batch = next(batches)
+                for i in range(1000):
+                    seen_posts.add(f'bench {batch} {i}')
+                seen_posts.flush()
+
+            # The first flush past the filter's capacity rebuilds it bigger,
+            # that's once per doubling and not what this times
+            record_new_posts()
+            results[f'record 1000 new posts onto {size} keys'] = measure(record_new_posts, min_seconds=min_seconds)
+            seen_posts.close()
+
+        for size in post_sizes:
+            for file_name in glob.glob('posts.db*'):
+                os.remove(file_name)
+            PostStore().add('bench', 'all', [synthetic_post(i) for i in range(size)])
+            # Fresh urns every call, the store only grows by a few batches
+            batches = itertools.count(size, 10)
+
+            def store_new_posts():
+                first = next(batches)
+                PostStore().add('bench', 'all', [synthetic_post(i) for i in range(first, first + 10)])
+
+            results[f'store 10 new posts onto {size}'] = measure(store_new_posts, min_seconds=min_seconds)
+            results[f'read newest 100 posts of {size}'] = measure(
+                lambda: PostStore().posts(['bench'], limit=100), min_seconds=min_seconds)
+    return results
+
+
+def bench_missing_people(people_sizes, min_seconds):
+    from flask_server import find_missing_people
+    from post_store import PostStore
+
+    results = {}
+    for size in people_sizes:
+        with in_temp_dir():
+            people = [f'person{i}' for i in range(size)]
+            # Every other person already has scraped posts
+            post_store = PostStore()
+            for i, person in enumerate(people[::2]):
+                post_store.add(person, 'all', [synthetic_post(i)])
+            results[f'find_missing_people {size}'] = measure(
+                lambda: find_missing_people(people), min_seconds=min_seconds)
+    return results
+
+
+def bench_near_dupes(index_sizes, min_seconds):
+    from near_dupes import NearDupes, signature, band_keys, pack, BANDS, ROWS
+
+    results = {}
+    # A repost of text with a different opening line
+    text = ' '.join(random_key(6) for _ in range(60))
+    repost = 'Great read from a colleague ' + text
+    results['minhash signature of a post'] = measure(lambda: signature(text), min_seconds=min_seconds)
+    for size in index_sizes:
+        with in_temp_dir():
+            near_dupes = NearDupes()
+            with near_dupes.transaction() as db:
+                # Random signatures, only the original shares bands with the repost
+                for i in range(size):
+                    values = signature(text) if i == size // 2 else [random.getrandbits(32) for _ in range(BANDS * ROWS)]
+                    db.execute('INSERT INTO signatures VALUES (?, ?, ?)', (f'urn{i}', f'urn{i}', pack(values)))
+                    db.executemany('INSERT INTO bands VALUES (?, ?)', [(key, f'urn{i}') for key in band_keys(values)])
+            values = signature(repost)
+            keys = band_keys(values)
+            with near_dupes.transaction() as db:
+                if near_dupes.find(db, values, keys) != f'urn{size // 2}':
+                    raise Exception("Near duplicate lookup missed the original")
+                results[f'near duplicate lookup against {size} posts'] = measure(
+                    lambda: near_dupes.find(db, values, keys), min_seconds=min_seconds)
+    return results
+
+
+def bench_load_data(feed_sizes, min_seconds):
+    from flask_server import make_server
+
+    results = {}
+    for size in feed_sizes:
+        with in_temp_dir():
+            os.makedirs('USER_REQUESTS')
+            os.makedirs(os.path.join('PROCESSED_POSTS', 'bench'))
+            with open(os.path.join('USER_REQUESTS', 'requests.json'), 'w') as file:
+                json.dump([{'ready': True, 'task': {'people': ['person0'], 'prompt': 'bench'}, 'user': 'bench'}], file)
+            with open(os.path.join('PROCESSED_POSTS', 'bench', 'bench.json'), 'w') as file:
+                json.dump([synthetic_post(i) for i in range(size)], file, indent=4)
+            client = make_server(JobQueue()).test_client()
+            counts = {'reads': 0, 'requests': 0}
+
+            def read_feed():
+                # Scrolls through the whole feed like the "Load more" button
+                cursor = None
+                while True:
+                    result = client.post('/load_data', json={'user': 'bench', 'id': 0, 'cursor': cursor}).get_json()
+                    counts['requests'] += 1
+                    cursor = result['cursor']
+                    if cursor is None:
+                        break
+                counts['reads'] += 1
+
+            seconds_per_read = measure(read_feed, min_seconds=min_seconds)
+            results[f'load_data page of a {size} post feed'] = seconds_per_read * counts['reads'] / counts['requests']
+    return results
+
+
+def bench_farm(worker_counts, profiles=FARM_PROFILES):
+    # Whole scrape runs against replay_server.py, one account per worker.
+    # Needs chromium, every run happens in a fresh python process in a temp
+    # dir so scrape_linkedin reads the config written here.
+    import yaml
+    from werkzeug.serving import make_server
+    from replay_server import make_replay_server
+    from post_store import PostStore
+
+    server = make_server('127.0.0.1', 0, make_replay_server(latency=0.3), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    repo = os.getcwd()
+    accounts = [f'bench{i}' for i in range(max(worker_counts))]
+    config = {'API_KEY': 'replay', 'topics': [], 'stalklist': [], 'blacklist': [], 'extensions': ['all'],
+              'posts_to_load': 10, 'PORT': 5000, 'credentials': {name: 'replay' for name in accounts},
+              'settings': {'timeout': 1000, 'classify': False, 'base_url': f'http://127.0.0.1:{server.server_port}', 'max_scrolls': 3}}
+    jobs = [(f'person{i}', 'all', []) for i in range(profiles)]
+
+    results = {}
+    try:
+        with in_temp_dir():
+            with open('config.yaml', 'w') as file:
+                yaml.safe_dump(config, file)
+            for workers in worker_counts:
+                with open('acc_usage_tracking.json', 'w') as file:
+                    json.dump([{'name': name, 'remaining_uses': 1000, 'last_used_date': '2025-01-01 00:00:00'}
+                               for name in accounts[:workers]], file)
+                for file_name in glob.glob('posts.db*'):
+                    os.remove(file_name)
+                start = time.perf_counter()
+                subprocess.run([sys.executable, '-c', f'import asyncio, scrape_farm; asyncio.run(scrape_farm.run_farm({jobs!r}, {workers}))'],
+                               env=dict(os.environ, PYTHONPATH=repo), check=True, stdout=subprocess.DEVNULL)
+                results[f'farm page load [{workers} workers]'] = (time.perf_counter() - start) / profiles
+                if len(PostStore().people_with_posts(person for person, _, _ in jobs)) != profiles:
+                    raise Exception(f"Farm run with {workers} workers didn't scrape every profile")
+    finally:
+        server.shutdown()
+    return results
+
+
+def check_parity(pages, backends):
+    # Every backend has to produce exactly the html.parser post dicts
+    failed = []
+    for name, parse, html in pages:
+        expected, _ = parse(html, set(), [], backends['html.parser'])
+        for backend_name, backend in backends.items():
+            out, _ = parse(html, set(), [], backend)
+            if out != expected:
+                failed.append((name, backend_name))
+    return failed
+
+
+def check_voyager_fixtures(post_html):
+    # The recorded voyager responses have to decode into posts with the
+    # same fields fetch_posts_person gives from the html
+    expected, _ = parse_posts_person(make_person_page(post_html, 1), set())
+    fields = set(expected[0])
+    failed = []
+    for path in sorted(glob.glob('voyager_responses/*.json')):
+        with open(path, encoding='utf-8') as f:
+            rows = parse_voyager_updates([json.load(f)])
+        if not rows or any(set(row) != fields for row in rows) or [row['id'] for row in rows] != sorted(row['id'] for row in rows):
+            failed.append((path, 'api'))
+    return failed
+
+
+async def check_browser_parity(html):
+    # Loads the activity page into a real Chromium and compares the bundled
+    # js extractor with the html.parser path. Needs `playwright install chromium`
+    from playwright.async_api import async_playwright
+
+    expected, _ = parse_posts_person(html, set(), [], PARSER_BACKENDS['html.parser']())
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        await page.set_content(f'<div class="scaffold-finite-scroll__content"><ul>{html}</ul></div>')
+        start = time.perf_counter()
+        rows = (await extract_posts_person(page, '.scaffold-finite-scroll__content ul'))['posts']
+        elapsed = time.perf_counter() - start
+        await browser.close()
+    return rows == expected, len(rows) / elapsed
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        tolerance = max([margin for prefix, margin in ABSOLUTE_TOLERANCE.items() if name.startswith(prefix)], default=0)
+        if seconds > baseline[name] * (1 + threshold) and seconds - baseline[name] > tolerance:
+            regressions.append((name, seconds, baseline[name]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scraper benchmark suite')
+    parser.add_argument('--browser', action='store_true', help='also check the js extractor in chromium')
+    parser.add_argument('--quick', action='store_true', help='smallest sizes only, shorter runs')
+    parser.add_argument('--farm', action='store_true', help='also time scrape_farm with 1, 2 and 4 workers against the replay server (needs chromium)')
+    parser.add_argument('--only', choices=['parse', 'lag', 'storage', 'people', 'near_dupes', 'load_data', 'farm'],
+                        help='run one group')
+    parser.add_argument('--save-baseline', action='store_true', help=f'write the results to {BASELINE_FILE}')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    min_seconds = 0.5 if args.quick else MIN_SECONDS
+    pick = (lambda sizes: sizes[:1]) if args.quick else (lambda sizes: sizes)
+    groups = {
+        'parse': lambda: {**bench_parsing(min_seconds), **bench_fetching(min_seconds)},
+        'storage': lambda: bench_storage(pick(KEY_SIZES), pick(POST_SIZES), min_seconds),
+        'lag': lambda: bench_loop_lag(LAG_PARSE_WORKERS),
+        'people': lambda: bench_missing_people(pick(PEOPLE_SIZES), min_seconds),
+        'near_dupes': lambda: bench_near_dupes(pick(NEAR_DUPE_SIZES), min_seconds),
+        'load_data': lambda: bench_load_data(pick(FEED_SIZES), min_seconds),
+    }
+    if args.farm or args.only == 'farm':
+        groups['farm'] = lambda: bench_farm(FARM_WORKERS)
+
+    random.seed(0)
+    results = {}
+    backends = {name: backend() for name, backend in PARSER_BACKENDS.items()}
+    # The code under test prints a lot, keep the output readable
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        failed = check_parity(build_pages(), backends)
+        failed += check_voyager_fixtures(load_fixture('pom.html'))
+        if args.browser:
+            browser_ok, browser_posts_per_sec = asyncio.run(
+                check_browser_parity(make_person_page(load_fixture('pom.html'))))
+            if not browser_ok:
+                failed.append(('pom.html (activity)', 'browser'))
+            results['extract pom.html (activity) [browser]'] = POSTS_PER_PAGE / browser_posts_per_sec
+        for name, group in groups.items():
+            if args.only in (None, name):
+                results.update(group())
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold)
+
+    for name, backend_name in failed:
+        print(f"PARITY FAILED: {name} with {backend_name}")
+    for name, seconds in results.items():
+        change = f"{(seconds / baseline[name] - 1) * 100:+7.1f}%" if name in baseline else "    new"
+        print(f"{name:60} {seconds * 1000:12.3f} ms {change}")
+    for name, seconds, before in regressions:
+        print(f"REGRESSION: {name} {before * 1000:.3f} ms -> {seconds * 1000:.3f} ms")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+    return not failed and not regressions
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,127 @@
+// In-browser version of parse_posts_person (scrape_functions.py).
+// Called through locator.evaluate on the activity list <ul> with
+// {schema: POST_SCHEMA, start, firstId, html}, returns the post dicts as JSON
+// so the page html never has to be copied over to python. Only the list
+// items from start on are looked at, their ids count from firstId. With html
+// set it returns those items' html for the python parsers instead. Either way
+// items is the list length and nextId the id of the item after it, the start
+// and firstId of the next call. saved_keys and the blacklist are applied on
+// the python side, ids don't depend on them.
+// Text is built the way BeautifulSoup does it (comments left out, whitespace
+// only strings squashed, slices counted in code points) so both paths match.
+(list, {schema, start = 0, firstId = 0, html = false}) => {
+    const SKIPPED = new Set(['script', 'style', 'template', 'rt', 'rp']);
+    const ASCII_SPACES = /^[ \n\t\f\r]*$/;
+    const PY_SPACE = '[\\t\\n\\x0b\\x0c\\r\\x1c-\\x1f \\x85\\xa0\\u1680\\u2000-\\u200a\\u2028\\u2029\\u202f\\u205f\\u3000]';
+    const LEFT = new RegExp('^' + PY_SPACE + '+');
+    const RIGHT = new RegExp(PY_SPACE + '+$');
+
+    const strip = (s) => s.replace(LEFT, '').replace(RIGHT, '');
+    const slice = (s, start, end) => Array.from(s).slice(start, end).join('');
+    const size = (node) => Array.from(node.childNodes).filter(
+        (child) => child.nodeType !== 3 || child.nodeValue !== '').length;
+
+    const compiled = {};
+    for (const [field, [tag, cls, keep]] of Object.entries(schema)) {
+        (compiled[tag] = compiled[tag] || []).push([field, cls, cls.includes(' '), keep === 'last']);
+    }
+
+    function strings(node, br, out) {
+        for (const child of node.childNodes) {
+            if (child.nodeType === 3) {
+                const text = child.nodeValue;
+                if (text === '') {
+                    continue;
+                }
+                out.push(ASCII_SPACES.test(text) ? (text.includes('\n') ? '\n' : ' ') : text);
+            } else if (child.nodeType === 1) {
+                if (child.localName === 'br') {
+                    out.push(br);
+                } else if (!SKIPPED.has(child.localName)) {
+                    strings(child, br, out);
+                }
+            }
+        }
+        return out;
+    }
+
+    const text = (node, br = '') => strings(node, br, []).join('');
+    const strippedText = (node) => strings(node, '', []).map(strip).filter((s) => s).join('');
+
+    function fields(post) {
+        const found = {};
+        for (const node of post.querySelectorAll('*')) {
+            const rules = compiled[node.localName];
+            if (!rules) {
+                continue;
+            }
+            const classes = (node.getAttribute('class') || '').split(/[ \n\t\f\r]+/).filter((c) => c);
+            if (!classes.length) {
+                continue;
+            }
+            const joined = classes.join(' ');
+            for (const [field, cls, whole, last] of rules) {
+                if (!last && field in found) {
+                    continue;
+                }
+                if (whole ? joined === cls : classes.includes(cls)) {
+                    found[field] = node;
+                }
+            }
+        }
+        return found;
+    }
+
+    const items = Array.from(list.children).filter((item) => item.localName === 'li');
+    const added = items.slice(start);
+    const posts = [];
+    let iter = firstId;
+
+    if (html) {
+        for (const postDiv of added) {
+            iter += fields(postDiv).content ? 1 : 9;
+        }
+        return {html: added.map((item) => item.outerHTML).join(''), items: items.length, nextId: iter};
+    }
+
+    for (const postDiv of added) {
+        const found = fields(postDiv);
+
+        const content = found.content;
+        if (!content) {
+            iter += 9;
+            continue;
+        }
+
+        const postIdElem = found.update;
+        const profileLinkTag = found.actor ? found.actor.querySelector('a') : null;
+        if (!postIdElem || !profileLinkTag || (postIdElem.getAttribute('data-id') || '').length > 35) {
+            iter += 1;
+            continue;
+        }
+
+        const post = {
+            profile_link: profileLinkTag.getAttribute('href'),
+            embeding_url: postIdElem.getAttribute('data-urn'),
+            post_text: slice(text(content, '\n'), 0, -9),
+            data_id: slice(strip(text(content)), 0, 35),
+            id: iter,
+        };
+
+        const img = found.img_wrapper ? found.img_wrapper.querySelector('img') : null;
+        if (img) {
+            post.img_link = img.getAttribute('src');
+        }
+
+        post.name = found.name ? strippedText(found.name.querySelector('span')) : '';
+        post.rank = found.rank ? strippedText(found.rank) : '';
+        post.description = found.description
+            ? slice(strippedText(found.description), 0, Math.floor(size(found.description) / 2)) : '';
+        post.time_posted = found.time_posted ? strippedText(found.time_posted) : '';
+
+        posts.push(post);
+        iter += 1;
+    }
+
+    return {posts, items: items.length, nextId: iter};
+}
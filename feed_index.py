@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+import struct
+
+# Processed feeds (PROCESSED_POSTS/{user}/{prompt}.json) are written one post
+# per line with a sidecar .idx file holding the byte offset where every post
+# starts, plus one past the last. A page of posts is two seeks, one into the
+# index and one into the feed, and parses only the posts it returns. The
+# feed stays a plain json list. Cursors handed to the browser are the
+# position of the next post, base64 encoded so clients don't build them.
+
+OFFSET = struct.Struct('<Q')
+SEPARATOR = b',\n'
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def write_feed(path, posts):
+    offsets = []
+    with open(path, 'wb') as file:
+        file.write(b'[\n')
+        for i, post in enumerate(posts):
+            if i:
+                file.write(SEPARATOR)
+            offsets.append(file.tell())
+            file.write(json.dumps(post).encode())
+        # As if another post followed, a page always ends a separator before
+        # the next offset
+        offsets.append(file.tell() + len(SEPARATOR))
+        file.write(b'\n]\n')
+    with open(index_path(path), 'wb') as file:
+        file.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+
+
+def ensure_index(path):
+    # Feeds written before the index existed get rewritten once
+    if not os.path.exists(index_path(path)):
+        with open(path, 'r') as file:
+            write_feed(path, json.load(file))
+
+
+def feed_length(path):
+    return os.path.getsize(index_path(path)) // OFFSET.size - 1
+
+
+def read_page(path, start, count):
+    # Posts start to start + count (or the end of the feed)
+    end = min(start + count, feed_length(path))
+    if start >= end:
+        return []
+    with open(index_path(path), 'rb') as file:
+        file.seek(start * OFFSET.size)
+        first, = OFFSET.unpack(file.read(OFFSET.size))
+        file.seek(end * OFFSET.size)
+        last, = OFFSET.unpack(file.read(OFFSET.size))
+    with open(path, 'rb') as file:
+        file.seek(first)
+        chunk = file.read(last - len(SEPARATOR) - first)
+    return json.loads(b'[' + chunk + b']')
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(str(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    # ValueError for anything encode_cursor didn't make
+    if not cursor:
+        return 0
+    if not isinstance(cursor, str):
+        raise ValueError(f'invalid cursor {cursor!r}')
+    position = int(base64.urlsafe_b64decode(cursor.encode()))
+    if position < 0:
+        raise ValueError(f'invalid cursor {cursor!r}')
+    return position
@@ -0,0 +1,45 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Parsed files for the flask server, least recently used out first. Keys
+# carry the file's version (mtime and size) so a rewritten file misses the
+# cache and its old entries just age out.
+
+
+def file_version(path):
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+class LRUCache:
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = load()
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def load_json(self, path):
+        # Shared with every caller, copy before changing it
+        def load():
+            with open(path, 'r') as file:
+                return json.load(file)
+        return self.get((path, file_version(path)), load)
@@ -1,20 +1,25 @@
-from flask import Flask, jsonify, send_from_directory, request, render_template
+from flask import Flask, Response, jsonify, send_from_directory, request, render_template
+import hashlib
 import os
 import json
 import webbrowser
 import yaml
-from multiprocessing import Queue
+from job_queue import JobQueue
+from post_store import PostStore, post_urn
+from feed_index import write_feed, ensure_index, read_page, feed_length, encode_cursor, decode_cursor, index_path
+from file_cache import LRUCache, file_version
 from scrape_linkedin import process_posts
 from datetime import datetime
 
 with open('config.yaml') as config_file:
     config = yaml.safe_load(config_file)
 
-DATA_FOLDER = "JSON_DATA"
 PROCESSED_DATA_FOLDER = "PROCESSED_POSTS\\mark"
 NUM_POSTS_PER_LOAD = config['posts_to_load']
 PORT = config['PORT']
-files = sorted(os.listdir(DATA_FOLDER))
+post_store = PostStore()
+# Parsed requests.json and feed pages
+cache = LRUCache(config['settings'].get('cache_size', 256))
 # REMOVE LATER - REPLACE WITH LOCAL REQUEST ISSUER PEOPLE_OF_INTEREST
 PEOPLE_OF_INTEREST = config['stalklist']
 TOPICS = config['topics']
@@ -32,70 +37,40 @@ def check_recomendations_exist(user="mark", prompt=str(TOPICS)):
 
 
 def find_people_by_id(id, user, return_prompt=0):
-    with open(os.path.join("USER_REQUESTS", "requests.json"), "r") as file:
-        data = json.load(file)
-
-        print(user)
-        print(id)
-        counter = 0
-        for line in data:
-            if line['user'] == user:
-                if counter == id:
-                    if(not return_prompt):
-                        return line['task']['people']
-                    else:
-                        return line['task']['prompt']
+    data = cache.load_json(os.path.join("USER_REQUESTS", "requests.json"))
+
+    print(user)
+    print(id)
+    counter = 0
+    for line in data:
+        if line['user'] == user:
+            if counter == id:
+                if(not return_prompt):
+                    return line['task']['people']
                 else:
-                    counter += 1
+                    return line['task']['prompt']
+            else:
+                counter += 1
     raise Exception("Invalid index sent")
 
 
 async def process_user_posts(id, user="mark", prompt=str(TOPICS)):
-    with open(f'PROCESSED_POSTS/{user}/{prompt}.json', "w+") as file1:
-        data = []
-        for person in find_people_by_id(id, user):
-            main_path = DATA_FOLDER + '/' + person
-            person_files = sorted(os.listdir(main_path))
-
-            for person_file in person_files:
-                file_path = os.path.join(main_path, person_file)
-                if not file_path.endswith(".json"):
-                    continue
-                print("Processing" + file_path + "\n\n\n\n")
+    posts = post_store.posts(find_people_by_id(id, user))
+    # A repost whose original is in the feed too only shows (and gets
+    # classified) once
+    urns = {post_urn(post) for post in posts}
+    posts = [post for post in posts if post.get('duplicate_of') not in urns]
+    data = await process_posts(posts, prompt)
+    # Keeps the new verdicts for the next feed with this prompt
+    post_store.update(posts)
 
-                with open(file_path, "r") as f:
-                    data += await process_posts(json.load(f), prompt)
-                #     print(json.load(f))
-                #     print("\n\n\n\n")
-
-        json.dump(data, file1, indent=4)
+    write_feed(os.path.join('PROCESSED_POSTS', user, f'{prompt}.json'), data)
 
 
 def find_missing_people(people):
-    missing_people: list[str] = []
-    for person in people:
-        main_path = os.path.join(DATA_FOLDER, person)
-        if not os.path.exists(main_path):
-            missing_people.append(person)
-            continue
-
-        files = sorted(os.listdir((main_path)))
-        if len(files) == 0:
-            missing_people.append(person)
-            continue
-        i = 0
-        while i < len(files) and not files[i].endswith(".json"):
-            i += 1
-
-        if i >= len(files):
-            missing_people.append(person)
-            continue
-
-        date = files[-1][(len(person) + len("_posts_")):-5]
-        print(date)
-        # if (datetime.now() - datetime.strptime(date, '%Y-%m-%d')).total_seconds()//(3600*24) >= 1:
-        # missing_people.append(person)
-    return missing_people
+    # People with no posts in the store yet
+    found = post_store.people_with_posts(people)
+    return [person for person in people if person not in found]
 
 
 def create_request_file(user, people, prompt, ready):
@@ -114,15 +89,24 @@ def create_request_file(user, people, prompt, ready):
         json.dump(data, file, indent=4)
 
 
-def check_ready(people):
-    missing_people = find_missing_people(people)
-    if len(missing_people) == 0:
-        return True
-    else:
+def check_ready(people, job_queue):
+    # Ready once none of the people is waiting on a scrape. The single job of
+    # a person settles every request that includes them, people whose scrape
+    # found no posts included.
+    jobs = job_queue.status(people)
+    if any(job['status'] in ('queued', 'leased') for job in jobs.values()):
         return False
+    return all(person in jobs for person in find_missing_people(people))
+
 
+def not_modified(etag):
+    # 304s carry the tag too, the client keeps using it
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
 
-def make_server(queue: Queue):
+
+def make_server(job_queue: JobQueue):
     app = Flask(__name__)
 
     @ app.route('/')
@@ -154,8 +138,9 @@ def make_server(queue: Queue):
             create_request_file(user, people, prompt, True)
             return jsonify({'ready': True, 'task': {'people': people, 'prompt': prompt}})
 
-        for person in missing_people:
-            queue.put(person)
+        # One job per person however many requests want them, a person
+        # already queued or being scraped just gets a higher priority
+        job_queue.enqueue(missing_people)
 
         create_request_file(user, people, prompt, False)
         return jsonify({'ready': False, 'task': {'people': people, 'prompt': prompt}})
@@ -169,19 +154,32 @@ def make_server(queue: Queue):
             return jsonify([])
 
         requests = []
-        with open(path, "r+") as file:
-            data = json.load(file)
-            for line in data:
-                if line['user'] != user:
-                    continue
-
-                if not line['ready']:
-                    line['ready'] = check_ready(line['task']['people'])
+        changed = False
+        # The cached lines are shared, copies get the new ready flags
+        data = [dict(line) for line in cache.load_json(path)]
+        for line in data:
+            if line['user'] != user:
+                continue
 
-                requests.append(line)
-        with open(path, "w") as file:
-            json.dump(data, file, indent=4)
-        return jsonify(requests)
+            if not line['ready']:
+                line['ready'] = check_ready(line['task']['people'], job_queue)
+                changed = changed or line['ready']
+
+            requests.append(line)
+        if changed:
+            with open(path, "w") as file:
+                json.dump(data, file, indent=4)
+        response = jsonify(requests)
+        response.add_etag()
+        # werkzeug's make_conditional only answers GETs
+        if request.if_none_match.contains(response.get_etag()[0]):
+            return not_modified(response.get_etag()[0])
+        return response
+
+    @ app.route('/job_status', methods=['POST'])
+    async def job_status():
+        # Where the scrape jobs of the given people (or all of them) are
+        return jsonify(job_queue.status(request.json.get("people")))
 
     @ app.route('/load_data', methods=['POST'])
     async def load_data():
@@ -192,44 +190,35 @@ def make_server(queue: Queue):
             await process_user_posts(id, user=user, prompt=prompt)
 
         print("rec checked")
-        file_index = int(request.json.get('file_index', -1))
-        elem_index = int(request.json.get('elem_index', 0))
-
-        processed_data_folder = os.path.join("PROCESSED_POSTS", user)
-        files = sorted(os.listdir(processed_data_folder))  # REPLACE LATER!!!
-
-        posts_left_to_load = NUM_POSTS_PER_LOAD
-        out = []
-        while file_index < len(files) and file_index != -1:
-            file_path = os.path.join(
-                processed_data_folder, files[-file_index-1])
-            if not file_path.endswith(".json"):
-                file_index += 1
-                continue
-
-            with open(file_path) as f:
-                data = json.load(f)
-
-            if elem_index + posts_left_to_load <= len(data):
-                out += data[elem_index:elem_index+posts_left_to_load]
-                elem_index += posts_left_to_load
-            else:
-                out += data[elem_index:]
-                if file_index + 1 < len(files):
-                    posts_left_to_load -= len(data[elem_index:])
-                    elem_index = 0
-                    file_index += 1
-                    continue
-                else:
-                    file_index = -1
-
-            return jsonify({'data': out, 'next': file_index, 'elem_index': elem_index})
-
-        return jsonify({'data': [], 'next': -1, 'elem_index': -1})
+        # The cursor is the position of the next post, a page reads only its
+        # own posts through the feed's index
+        path = os.path.join('PROCESSED_POSTS', user, f'{prompt}.json')
+        ensure_index(path)
+        try:
+            start = decode_cursor(request.json.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'invalid cursor'}), 400
+        # A page only changes with the feed, the browser's copy is still
+        # good when the tag matches. The feed's path is in the tag, two feeds
+        # can have the same version.
+        version = file_version(index_path(path))
+        feed = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+        etag = f'{feed}-{version}-{start}-{NUM_POSTS_PER_LOAD}'
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+        def load_page():
+            data = read_page(path, start, NUM_POSTS_PER_LOAD)
+            end = start + len(data)
+            return {'data': data, 'cursor': encode_cursor(end) if end < feed_length(path) else None}
+
+        response = jsonify(cache.get((path, version, start, NUM_POSTS_PER_LOAD), load_page))
+        response.set_etag(etag)
+        return response
     return app
 
 
 if __name__ == '__main__':
     webbrowser.open_new_tab("http://127.0.0.1:5000")
-    app = make_server(Queue())
+    app = make_server(JobQueue())
     app.run(port=PORT, debug=False)
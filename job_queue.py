@@ -0,0 +1,157 @@
+import sqlite3
+import time
+
+import sqlite_db
+
+# Scrape jobs (one per person) in a SQLite file shared by the flask server
+# and the scraper process, so they survive restarts. A person already queued
+# isn't queued twice, asking again raises its priority instead. The scraper
+# leases jobs for a while (the visibility timeout), a lease that runs out
+# without complete() makes the job available again. Failed jobs come back
+# after a doubling delay until MAX_ATTEMPTS, so do expired leases.
+
+JOBS_FILE = 'jobs.db'
+LEASE_SECONDS = 3600
+MAX_ATTEMPTS = 5
+RETRY_SECONDS = 60
+# Without a wakeup event the waiting side checks the file this often
+IDLE_POLL_SECONDS = 5
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    person TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, available_at);
+'''
+
+
+class JobQueue:
+    # wakeup is a multiprocessing.Event shared by the processes, enqueue()
+    # sets it and wait() sleeps on it
+
+    def __init__(self, path=JOBS_FILE, wakeup=None):
+        self.path = path
+        self.wakeup = wakeup
+        sqlite_db.open_db(path, SCHEMA)
+
+    def transaction(self):
+        return sqlite_db.transaction(self.path, sqlite3.Row)
+
+    def read(self):
+        return sqlite_db.connect(self.path, sqlite3.Row)
+
+    def enqueue(self, people, priority=1):
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany('''
+                INSERT INTO jobs (person, priority, status, available_at, updated_at)
+                VALUES (?, ?, 'queued', ?, ?)
+                ON CONFLICT (person) DO UPDATE SET
+                    priority = CASE WHEN status IN ('done', 'failed') THEN excluded.priority
+                                    ELSE priority + excluded.priority END,
+                    attempts = CASE WHEN status IN ('done', 'failed') THEN 0 ELSE attempts END,
+                    available_at = CASE WHEN status IN ('done', 'failed') THEN excluded.available_at
+                                        ELSE available_at END,
+                    status = CASE WHEN status IN ('done', 'failed') THEN 'queued' ELSE status END,
+                    updated_at = excluded.updated_at
+            ''', [(person, priority, now, now) for person in people])
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def lease(self, limit=-1, lease_seconds=LEASE_SECONDS):
+        # The people to scrape now, highest priority first. Jobs whose lease
+        # ran out count as queued, unless that was their last attempt (a
+        # scraper that keeps dying on them never calls fail()).
+        now = time.time()
+        with self.transaction() as db:
+            db.execute('''
+                UPDATE jobs SET status = 'failed', lease_until = NULL, error = 'lease expired', updated_at = ?
+                WHERE status = 'leased' AND lease_until <= ? AND attempts >= ?
+            ''', (now, now, MAX_ATTEMPTS))
+            people = [row['person'] for row in db.execute('''
+                SELECT person FROM jobs
+                WHERE (status = 'queued' AND available_at <= ?) OR (status = 'leased' AND lease_until <= ?)
+                ORDER BY priority DESC, available_at
+                LIMIT ?
+            ''', (now, now, limit))]
+            db.executemany('''
+                UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_until = ?, updated_at = ?
+                WHERE person = ?
+            ''', [(now + lease_seconds, now, person) for person in people])
+        return people
+
+    def complete(self, people):
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany('''
+                UPDATE jobs SET status = 'done', lease_until = NULL, error = NULL, updated_at = ?
+                WHERE person = ?
+            ''', [(now, person) for person in people])
+
+    def fail(self, person, error):
+        # Back in the queue after RETRY_SECONDS, 2x, 4x... or given up on
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute('SELECT attempts FROM jobs WHERE person = ?', (person,)).fetchone()
+            if row is None:
+                return
+            if row['attempts'] >= MAX_ATTEMPTS:
+                db.execute('''
+                    UPDATE jobs SET status = 'failed', lease_until = NULL, error = ?, updated_at = ?
+                    WHERE person = ?
+                ''', (error, now, person))
+            else:
+                db.execute('''
+                    UPDATE jobs SET status = 'queued', lease_until = NULL, error = ?, available_at = ?, updated_at = ?
+                    WHERE person = ?
+                ''', (error, now + RETRY_SECONDS * 2 ** (row['attempts'] - 1), now, person))
+
+    def release(self, people, delay=RETRY_SECONDS):
+        # Back in the queue without using up an attempt (no account uses
+        # left for them)
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany('''
+                UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), lease_until = NULL,
+                    available_at = ?, updated_at = ?
+                WHERE person = ? AND status = 'leased'
+            ''', [(now + delay, now, person) for person in people])
+
+    def status(self, people=None):
+        with self.read() as db:
+            if people is None:
+                rows = db.execute('SELECT * FROM jobs').fetchall()
+            else:
+                rows = db.execute(f"SELECT * FROM jobs WHERE person IN ({','.join('?' * len(people))})",
+                                  list(people)).fetchall()
+        return {row['person']: {'status': row['status'], 'priority': row['priority'], 'attempts': row['attempts'],
+                                'error': row['error'], 'available_at': row['available_at']} for row in rows}
+
+    def next_due(self):
+        # Seconds until some job can be leased, None when there are none
+        with self.read() as db:
+            due = db.execute('''
+                SELECT MIN(CASE status WHEN 'queued' THEN available_at ELSE lease_until END)
+                FROM jobs WHERE status IN ('queued', 'leased')
+            ''').fetchone()[0]
+        return None if due is None else max(0, due - time.time())
+
+    def wait(self):
+        # Blocks until some job can be leased
+        while True:
+            if self.wakeup is not None:
+                self.wakeup.clear()
+            delay = self.next_due()
+            if delay == 0:
+                return
+            if self.wakeup is None:
+                time.sleep(IDLE_POLL_SECONDS if delay is None else min(delay, IDLE_POLL_SECONDS))
+            else:
+                self.wakeup.wait(delay)
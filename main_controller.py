@@ -1,37 +1,40 @@
-from multiprocessing import Process, Queue, current_process
-import time
+from multiprocessing import Process, Event
 from flask_server import make_server, PORT
 import webbrowser
 from scrape_linkedin import main as run_scraper
+from job_queue import JobQueue
 import asyncio
 
 
-def start_flask(queue: Queue):
-    app = make_server(queue)
+def start_flask(wakeup):
+    app = make_server(JobQueue(wakeup=wakeup))
     webbrowser.open_new_tab("http://127.0.0.1:5000")
     app.run(port=PORT, debug=False)
 
 
-def start_search(q):
-    asyncio.run(run_scraper(q))
+def start_search(wakeup):
+    # Sleeps until the server queues someone (or a retry is due), then
+    # scrapes everything that can be leased
+    job_queue = JobQueue(wakeup=wakeup)
+    while True:
+        job_queue.wait()
+        asyncio.run(run_scraper(job_queue))
 
 
 def main():
-    q = Queue()
-    p1 = Process(target=start_flask, args=(q,), name="Main server")
+    # Set by the server on every new job so the scraper doesn't poll
+    wakeup = Event()
+    p1 = Process(target=start_flask, args=(wakeup,), name="Main server")
     p1.start()
-    p2 = None
+    p2 = Process(target=start_search, args=(wakeup,), name="Search")
+    p2.start()
     try:
-        while True:
-            time.sleep(1)
-            if not q.empty():
-                if True is False and (p2 is None or not p2.is_alive()):
-                    p2 = Process(target=start_search, args=(q,), name="Search")
-                    p2.start()
-    except:
         p1.join()
-        if p2:
-            p2.join()
+    except:
+        pass
+    p2.terminate()
+    p1.join()
+    p2.join()
     return
 
 
@@ -0,0 +1,48 @@
+import asyncio
+import time
+from collections import defaultdict
+
+# In-process run metrics. Samples are timings/sizes collected during a run,
+# gauges hold the latest value of something (current limits, queue depths).
+
+samples = defaultdict(list)
+gauges = {}
+
+
+def record(name, value):
+    samples[name].append(value)
+
+
+def set_gauge(name, value):
+    gauges[name] = value
+
+
+async def watch_loop_lag(interval=0.1):
+    # How late the event loop wakes up a sleeper, anything blocking the loop
+    # (parsing, file writes) shows up here. Runs until cancelled.
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        record('loop_lag', time.monotonic() - start - interval)
+
+
+def summary():
+    out = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        out[name] = {'count': len(values), 'total': sum(values),
+                     'avg': sum(values) / len(values), 'max': max(values)}
+    return out
+
+
+def print_summary():
+    for name, stats in sorted(summary().items()):
+        print(f"{name}: count={stats['count']} total={stats['total']:.2f} avg={stats['avg']:.3f} max={stats['max']:.3f}")
+    for name, value in sorted(gauges.items()):
+        print(f"{name}: {value}")
+
+
+def reset():
+    samples.clear()
+    gauges.clear()
@@ -0,0 +1,133 @@
+import hashlib
+import random
+import re
+import struct
+import unicodedata
+
+import sqlite_db
+
+# Near duplicate posts (reposts, the same announcement posted by coworkers,
+# edited openings) found with MinHash over word 3-grams of the normalized
+# text. The signature is split into BANDS bands of ROWS values, posts that
+# share any whole band are candidates (an index lookup per band) and a
+# candidate is a duplicate when the signatures estimate a Jaccard similarity
+# of at least SIMILARITY. Every post points at the canonical post of its
+# cluster, the first one seen.
+
+NEAR_DUPES_FILE = 'near_dupes.db'
+BANDS = 16
+ROWS = 4
+SIMILARITY = 0.6
+# Shorter texts have too few shingles for the signature to mean much
+MIN_WORDS = 8
+
+PRIME = (1 << 61) - 1
+# Fixed seed, signatures have to stay comparable between runs
+_random = random.Random(20250407)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(PRIME)) for _ in range(BANDS * ROWS)]
+
+URL_PATTERN = re.compile(r'https?://\S+|www\.\S+')
+WORD_PATTERN = re.compile(r'\w+')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS signatures (
+    urn TEXT PRIMARY KEY,
+    canonical TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    key INTEGER NOT NULL,
+    urn TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_key ON bands (key);
+'''
+
+
+def normalize(text):
+    # NFKC folds the bold/italic unicode letters posts like to use
+    text = unicodedata.normalize('NFKC', text).lower()
+    return WORD_PATTERN.findall(URL_PATTERN.sub(' ', text))
+
+
+def signature(text):
+    # None for texts too short to compare
+    words = normalize(text)
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = {int.from_bytes(hashlib.blake2b(' '.join(words[i:i + 3]).encode(), digest_size=8).digest(), 'big')
+                for i in range(len(words) - 2)}
+    return [min((a * shingle + b) % PRIME for shingle in shingles) & 0xffffffff for a, b in PERMUTATIONS]
+
+
+def band_keys(values):
+    keys = []
+    for band in range(BANDS):
+        packed = struct.pack(f'>I{ROWS}I', band, *values[band * ROWS:(band + 1) * ROWS])
+        keys.append(int.from_bytes(hashlib.blake2b(packed, digest_size=8).digest(), 'big', signed=True))
+    return keys
+
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def pack(values):
+    return struct.pack(f'>{len(values)}I', *values)
+
+
+def unpack(blob):
+    return struct.unpack(f'>{len(blob) // 4}I', blob)
+
+
+class NearDupes:
+
+    def __init__(self, path=NEAR_DUPES_FILE):
+        self.path = path
+        sqlite_db.open_db(path, SCHEMA)
+
+    def transaction(self):
+        return sqlite_db.transaction(self.path)
+
+    def read(self):
+        return sqlite_db.connect(self.path)
+
+    def find(self, db, values, keys):
+        # Canonical urn of the most similar known post, None below SIMILARITY
+        rows = db.execute(f'''
+            SELECT signatures.canonical, signatures.signature FROM signatures
+            WHERE urn IN (SELECT urn FROM bands WHERE key IN ({','.join('?' * len(keys))}))
+        ''', keys)
+        best = None
+        for canonical, blob in rows:
+            score = similarity(values, unpack(blob))
+            if score >= SIMILARITY and (best is None or score > best[0]):
+                best = (score, canonical)
+        return best and best[1]
+
+    def canonical(self, text):
+        values = signature(text)
+        if values is None:
+            return None
+        with self.read() as db:
+            return self.find(db, values, band_keys(values))
+
+    def cluster(self, posts, key):
+        # Marks posts that are near duplicates of an earlier one with
+        # 'duplicate_of' (its canonical urn) and indexes them all, returns how
+        # many were duplicates. key(post) is the post's urn.
+        duplicates = 0
+        with self.transaction() as db:
+            for post in posts:
+                values = signature(post.get('post_text') or '')
+                if values is None:
+                    continue
+                urn = key(post)
+                keys = band_keys(values)
+                canonical = self.find(db, values, keys)
+                if canonical is not None and canonical != urn:
+                    post['duplicate_of'] = canonical
+                    duplicates += 1
+                if db.execute('INSERT OR IGNORE INTO signatures VALUES (?, ?, ?)',
+                              (urn, canonical or urn, pack(values))).rowcount:
+                    db.executemany('INSERT INTO bands VALUES (?, ?)', [(band_key, urn) for band_key in keys])
+        return duplicates
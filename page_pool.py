@@ -0,0 +1,93 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import metrics
+from scrape_functions import block_resources, record_blocked
+
+
+def read_cookies(username):
+    try:
+        with open(f'cookies{username}.json', 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print("No saved cookies found.")
+        return []
+
+
+class PagePool:
+    # Warm contexts and pages for one account. Every page gets its own context
+    # (so blocked request counts stay per page), cookies are read from disk
+    # once, and a page is recycled after max_navigations leases or when it
+    # fails the health check. size should be the most pages the account's
+    # limiter lets run at once.
+
+    def __init__(self, browser, username, size=2, max_navigations=50, blocking={}):
+        self.browser = browser
+        self.username = username
+        self.max_navigations = max_navigations
+        self.blocking = blocking
+        self.cookies = read_cookies(username)
+        # Last in first out, warm pages get reused before an empty slot opens
+        # a new one, so only as many pages open as ran at once
+        self.idle = asyncio.LifoQueue()
+        # Empty slots, the pages are opened on first lease
+        for _ in range(size):
+            self.idle.put_nowait(None)
+
+    async def open_entry(self):
+        context = await self.browser.new_context()
+        blocked = await block_resources(context, self.blocking)
+        if self.cookies:
+            await context.add_cookies(self.cookies)
+        page = await context.new_page()
+        metrics.record('pool_pages_opened', 1)
+        return {'context': context, 'page': page, 'blocked': blocked, 'navigations': 0}
+
+    async def close_entry(self, entry):
+        try:
+            await entry['context'].close()
+        except Exception as e:
+            print(e)
+
+    async def healthy(self, entry):
+        if entry['page'].is_closed():
+            return False
+        try:
+            await asyncio.wait_for(entry['page'].evaluate("1"), timeout=5)
+            return True
+        except Exception:
+            return False
+
+    @asynccontextmanager
+    async def lease(self):
+        entry = await self.idle.get()
+        try:
+            if entry is not None and (entry['navigations'] >= self.max_navigations or not await self.healthy(entry)):
+                await self.close_entry(entry)
+                entry = None
+            if entry is None:
+                entry = await self.open_entry()
+        except BaseException:
+            self.idle.put_nowait(None)
+            raise
+
+        try:
+            yield entry['page']
+            entry['navigations'] += 1
+        except BaseException:
+            # Whatever broke might have left the page in a bad state
+            await self.close_entry(entry)
+            record_blocked(entry['blocked'])
+            entry = None
+            raise
+        finally:
+            if entry is not None:
+                record_blocked(entry['blocked'])
+            self.idle.put_nowait(entry)
+
+    async def close(self):
+        while not self.idle.empty():
+            entry = self.idle.get_nowait()
+            if entry is not None:
+                await self.close_entry(entry)
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import metrics
+
+# Put once per worker to shut a stage down
+DONE = object()
+
+
+class Stage:
+    # One step of the scrape pipeline. `workers` coroutines take items off a
+    # bounded inbox, run handle(item) and pass whatever it returns (None
+    # drops the item) on to the next stage. A full inbox makes put() wait,
+    # so a slow stage (the LLM) slows down the ones before it instead of
+    # piling up work. Queue depth is recorded on every put, items per second
+    # when the stage closes.
+
+    def __init__(self, name, handle, workers=1, maxsize=100, next_stage=None):
+        self.name = name
+        self.handle = handle
+        self.next_stage = next_stage
+        self.inbox = asyncio.Queue(maxsize)
+        self.processed = 0
+        self.started = time.monotonic()
+        self.workers = [asyncio.create_task(self.work()) for _ in range(workers)]
+
+    async def put(self, item):
+        await self.inbox.put(item)
+        metrics.record(f'queue_depth[{self.name}]', self.inbox.qsize())
+
+    async def work(self):
+        while True:
+            item = await self.inbox.get()
+            if item is DONE:
+                return
+            try:
+                out = await self.handle(item)
+            except Exception as e:
+                print(f"{self.name} failed: {e}")
+                metrics.record(f'stage_errors[{self.name}]', 1)
+                continue
+            self.processed += 1
+            if out is not None and self.next_stage is not None:
+                await self.next_stage.put(out)
+
+    async def close(self):
+        # Finishes everything queued, then closes the stages after this one
+        for _ in self.workers:
+            await self.inbox.put(DONE)
+        await asyncio.gather(*self.workers)
+        elapsed = time.monotonic() - self.started
+        metrics.set_gauge(f'stage_throughput[{self.name}]',
+                          f'{self.processed} items, {self.processed / elapsed:.2f}/s')
+        if self.next_stage is not None:
+            await self.next_stage.close()
@@ -0,0 +1,165 @@
+import datetime
+import glob
+import json
+import os
+import sqlite3
+import time
+
+import sqlite_db
+
+# Scraped posts in one SQLite file (WAL, so flask reads while the scraper
+# writes), keyed by the post's urn. A post belongs to every person whose
+# page showed it (a repost, a coworker's announcement), one row in links
+# for each, indexed on person, extension and scrape time. Saving costs the
+# new posts only, reading a person's posts is an index range scan. Posts
+# are kept as the scraper's json dicts, the person and ext columns of posts
+# are the page it was first stored from.
+
+POSTS_FILE = 'posts.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS posts (
+    urn TEXT PRIMARY KEY,
+    person TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    post TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    urn TEXT NOT NULL,
+    person TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    PRIMARY KEY (urn, person, ext)
+);
+CREATE INDEX IF NOT EXISTS links_person ON links (person, scraped_at);
+CREATE INDEX IF NOT EXISTS links_ext ON links (ext, scraped_at);
+CREATE INDEX IF NOT EXISTS links_scraped_at ON links (scraped_at);
+DROP INDEX IF EXISTS posts_person;
+DROP INDEX IF EXISTS posts_ext;
+DROP INDEX IF EXISTS posts_scraped_at;
+'''
+
+
+def post_urn(post):
+    # Posts without an urn (older html layouts) fall back to their text key
+    return post.get('embeding_url') or post['data_id']
+
+
+class PostStore:
+
+    def __init__(self, path=POSTS_FILE):
+        self.path = path
+        sqlite_db.open_db(path, SCHEMA)
+        with self.read() as db:
+            linked = db.execute('SELECT 1 FROM links LIMIT 1').fetchone()
+        if linked is None:
+            # Stores from before links existed, every post gets linked to the
+            # page it came from
+            with self.transaction() as db:
+                db.execute('''
+                    INSERT OR IGNORE INTO links (urn, person, ext, scraped_at)
+                    SELECT urn, person, ext, scraped_at FROM posts ORDER BY rowid
+                ''')
+
+    def transaction(self):
+        return sqlite_db.transaction(self.path, sqlite3.Row)
+
+    def read(self):
+        return sqlite_db.connect(self.path, sqlite3.Row)
+
+    def add(self, person, ext, posts, scraped_at=None):
+        # posts come newest first like the page shows them. They go in oldest
+        # first so newer rows get higher rowids and reads walk the index
+        # backwards without sorting. A post that's already stored keeps its
+        # place and gets the newer copy.
+        return self.write(person, ext, posts, scraped_at, '''
+            INSERT INTO posts (urn, person, ext, scraped_at, post) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (urn) DO UPDATE SET post = excluded.post
+        ''')
+
+    def link(self, person, ext, posts, scraped_at=None):
+        # Like add() for posts stored from another page before. They show up
+        # for this person too, the stored copy (and its verdicts) stays.
+        return self.write(person, ext, posts, scraped_at, '''
+            INSERT OR IGNORE INTO posts (urn, person, ext, scraped_at, post) VALUES (?, ?, ?, ?, ?)
+        ''')
+
+    def write(self, person, ext, posts, scraped_at, insert_post):
+        scraped_at = scraped_at or time.time()
+        oldest_first = list(reversed(posts))
+        with self.transaction() as db:
+            db.executemany(insert_post, [(post_urn(post), person, ext, scraped_at, json.dumps(post))
+                                         for post in oldest_first])
+            db.executemany('INSERT OR IGNORE INTO links (urn, person, ext, scraped_at) VALUES (?, ?, ?, ?)',
+                           [(post_urn(post), person, ext, scraped_at) for post in oldest_first])
+        return posts
+
+    def update(self, posts):
+        # Writes back posts that were read from the store (classifier verdicts)
+        with self.transaction() as db:
+            db.executemany('UPDATE posts SET post = ? WHERE urn = ?',
+                           [(json.dumps(post), post_urn(post)) for post in posts])
+
+    def posts(self, people=None, ext=None, since=None, until=None, limit=-1):
+        # Newest scrape first, page order within a scrape, every post once
+        # however many of the people it's linked to. since/until are
+        # timestamps of the scrape.
+        where, args = [], []
+        if people is not None:
+            people = list(people)
+            where.append(f"links.person IN ({','.join('?' * len(people))})")
+            args += people
+        if ext is not None:
+            where.append('links.ext = ?')
+            args.append(ext)
+        if since is not None:
+            where.append('links.scraped_at >= ?')
+            args.append(since)
+        if until is not None:
+            where.append('links.scraped_at < ?')
+            args.append(until)
+        query = 'SELECT links.urn, posts.post FROM links JOIN posts USING (urn)'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY links.scraped_at DESC, links.rowid DESC'
+        # Walks the index newest first and keeps the newest link of a post,
+        # stops reading once limit posts are in
+        found = {}
+        with self.read() as db:
+            for row in db.execute(query, args):
+                if len(found) == limit:
+                    break
+                if row['urn'] not in found:
+                    found[row['urn']] = row['post']
+        return [json.loads(post) for post in found.values()]
+
+    def people_with_posts(self, people):
+        people = list(people)
+        with self.read() as db:
+            rows = db.execute(f"SELECT DISTINCT person FROM links WHERE person IN ({','.join('?' * len(people))})",
+                              people).fetchall()
+        return {row['person'] for row in rows}
+
+    def import_json_data(self, folder='JSON_DATA'):
+        # One off move of the old {person}_posts_{date}.json files (flat or in
+        # per person folders) into the store
+        count = 0
+        for file_name in sorted(glob.glob(os.path.join(folder, '**', '*.json'), recursive=True)):
+            name = os.path.basename(file_name)[:-len('.json')]
+            person, separator, date = name.rpartition('_posts_')
+            if not separator:
+                person, date = '', name.partition('posts_')[2]
+            try:
+                scraped_at = datetime.datetime.strptime(date, '%Y-%m-%d').timestamp()
+            except ValueError:
+                scraped_at = os.path.getmtime(file_name)
+            with open(file_name, 'r') as file:
+                posts = [post for post in json.load(file) if post.get('embeding_url') or post.get('data_id')]
+            self.add(person, 'all', posts, scraped_at)
+            count += len(posts)
+        return count
+
+
+if __name__ == '__main__':
+    print(f"Imported {PostStore().import_json_data()} posts")
@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import time
+
+import lxml.html
+from flask import Flask, jsonify, redirect, request, make_response
+
+from benchmark_scrape import load_fixture, make_person_page, make_feed_page
+from scrape_functions import RECORDINGS_FOLDER
+
+# Local stand-in for LinkedIn. Serves the snapshots saved with
+# `settings: record: true` under the real url paths, or pages built from
+# pom.html for people without a recording. Set `settings: base_url:` to this
+# server (e.g. http://127.0.0.1:5050) to run scrape_linkedin.main offline.
+# Use a throwaway account name in acc_usage_tracking.json, logging in here
+# overwrites its cookies file.
+
+PAGE_SIZE = 5
+SYNTHETIC_POSTS = 20
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>{title}</title></head>
+<body>
+<div class="scaffold-finite-scroll__content"><ul>{items}</ul></div>
+<div style="height: 1500px"></div>
+<script>
+    let next = {next};
+    let loading = false;
+    window.addEventListener('scroll', async () => {{
+        if (loading || next < 0 || window.innerHeight + window.scrollY < document.body.scrollHeight - 10) {{
+            return;
+        }}
+        loading = true;
+        const response = await fetch('/voyager/api/replay{path}?start=' + next);
+        const data = await response.json();
+        document.querySelector('.scaffold-finite-scroll__content ul').insertAdjacentHTML('beforeend', data.html);
+        next = data.next;
+        loading = false;
+    }});
+</script>
+</body>
+</html>'''
+
+LOGIN_PAGE = '''<!DOCTYPE html>
+<html>
+<body>
+<form method="post" action="/login">
+    <input id="username" name="session_key">
+    <input id="password" name="session_password" type="password">
+    <button class="btn__primary--large from__button--floating" type="submit">Sign in</button>
+</form>
+</body>
+</html>'''
+
+
+def read_recording(name):
+    file_name = os.path.join(RECORDINGS_FOLDER, name + '.html')
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, encoding='utf-8') as file:
+        return file.read()
+
+
+def list_items(person, extension, post_html):
+    html = read_recording(f'in/{person}/recent-activity/{extension}')
+    if html is None:
+        html = make_person_page(post_html, SYNTHETIC_POSTS, prefix=f'{person} {extension} ')
+    items = lxml.html.fragment_fromstring(html, create_parent='ul').findall('li')
+    return [lxml.html.tostring(item, encoding='unicode') for item in items]
+
+
+def make_replay_server(latency=0.0, fail_rate=0.0, fail_status=429, page_size=PAGE_SIZE):
+    app = Flask(__name__)
+    post_html = load_fixture('pom.html')
+    # Split list items per profile, built on first request
+    cache = {}
+
+    def items_for(person, extension):
+        if (person, extension) not in cache:
+            cache[(person, extension)] = list_items(person, extension, post_html)
+        return cache[(person, extension)]
+
+    @app.before_request
+    def slow_and_flaky():
+        if latency:
+            time.sleep(latency * random.uniform(0.5, 1.5))
+        if fail_rate and request.path != '/login' and random.random() < fail_rate:
+            return make_response('', fail_status)
+
+    @app.route('/login', methods=['GET', 'POST'])
+    def login():
+        if request.method == 'POST' or request.cookies.get('li_at'):
+            response = redirect('/feed/')
+            response.set_cookie('li_at', 'replay')
+            return response
+        return LOGIN_PAGE
+
+    @app.route('/feed/')
+    def feed():
+        if not request.cookies.get('li_at'):
+            return redirect('/login')
+        html = read_recording('feed')
+        if html is None:
+            html = make_feed_page(post_html, page_size, prefix='feed ')
+        return f'<!DOCTYPE html><html><body><div class="scaffold-finite-scroll__content">{html}</div></body></html>'
+
+    @app.route('/in/<person>/recent-activity/<extension>')
+    @app.route('/in/<person>/recent-activity/<extension>/')
+    def activity(person, extension):
+        items = items_for(person, extension)
+        path = f'/in/{person}/recent-activity/{extension}'
+        return PAGE.format(title=person, items=''.join(items[:page_size]),
+                           next=page_size if len(items) > page_size else -1, path=path)
+
+    @app.route('/voyager/api/replay/in/<person>/recent-activity/<extension>')
+    def more_activity(person, extension):
+        items = items_for(person, extension)
+        start = int(request.args.get('start', 0))
+        end = start + page_size
+        return jsonify({'html': ''.join(items[start:end]), 'next': end if end < len(items) else -1})
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline LinkedIn stand-in for scraper benchmarks')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency', type=float, default=0.0, help='average seconds added to every request')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with --fail-status')
+    parser.add_argument('--fail-status', type=int, default=429, help='429, or 999 like LinkedIn does')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='posts loaded per scroll')
+    args = parser.parse_args()
+    app = make_replay_server(args.latency, args.fail_rate, args.fail_status, args.page_size)
+    app.run(port=args.port, debug=False, threaded=True)
@@ -0,0 +1,98 @@
+import datetime
+import json
+import os
+import re
+
+# Learns how often each profile page (person and extension) gets new posts
+# and orders the crawl by how many new posts a page load is expected to
+# bring. Every good scrape adds the gaps between the new posts' times (from
+# LinkedIn's "3d", "2w" labels) to a decayed average of the gap. A page that
+# stayed quiet for longer than its average stretches it.
+
+REVISIT_FILE = 'revisit_stats.json'
+# Weight of the latest gap in the average
+DECAY = 0.3
+# Assumed gap for pages we know nothing about yet
+PRIOR_GAP_HOURS = 24
+MIN_GAP_HOURS = 0.5
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+AGE_HOURS = {'s': 1 / 3600, 'm': 1 / 60, 'h': 1, 'd': 24, 'w': 24 * 7, 'mo': 24 * 30, 'yr': 24 * 365}
+AGE_PATTERN = re.compile(r'(\d+)\s*(mo|yr|s|m|h|d|w)\b')
+
+
+def load_stats():
+    if os.path.exists(REVISIT_FILE):
+        with open(REVISIT_FILE, 'r') as file:
+            return json.load(file)
+    return dict()
+
+
+def save_stats(stats):
+    with open(REVISIT_FILE, 'w') as file:
+        json.dump(stats, file, indent=4)
+
+
+def post_age_hours(time_posted):
+    match = AGE_PATTERN.search(time_posted or '')
+    if match is None:
+        return None
+    return int(match.group(1)) * AGE_HOURS[match.group(2)]
+
+
+def average_in(gap, new_gap):
+    return (1 - DECAY) * gap + DECAY * max(MIN_GAP_HOURS, new_gap)
+
+
+def record_visit(stats, result, now=None):
+    # result is what scrape_person returned, its posts are the ones newer
+    # than the watermark
+    if result.get('outcome') != 'ok':
+        return
+    now = now or datetime.datetime.now()
+    key = f"{result['person']}/{result['ext']}"
+    entry = stats.setdefault(key, {'gap_hours': PRIOR_GAP_HOURS, 'last_post': None, 'last_visit': None})
+
+    last_post = datetime.datetime.strptime(entry['last_post'], TIME_FORMAT) if entry['last_post'] else None
+    posted = []
+    for post in result['posts']:
+        age = post_age_hours(post.get('time_posted'))
+        if age is None:
+            continue
+        time = now - datetime.timedelta(hours=age)
+        # Reactions, comments and reposts carry the age of the original
+        # post, anything not newer than last_post says nothing about the gap
+        if last_post is None or time > last_post:
+            posted.append(time)
+    posted.sort()
+
+    for time in posted:
+        if last_post is not None:
+            entry['gap_hours'] = average_in(entry['gap_hours'], (time - last_post).total_seconds() / 3600)
+        last_post = time
+    if not posted and last_post is not None:
+        # Nothing new, the page has been quiet at least this long
+        quiet = (now - last_post).total_seconds() / 3600
+        if quiet > entry['gap_hours']:
+            entry['gap_hours'] = average_in(entry['gap_hours'], quiet)
+
+    if last_post is not None:
+        entry['last_post'] = last_post.strftime(TIME_FORMAT)
+    entry['last_visit'] = now.strftime(TIME_FORMAT)
+
+
+def expected_new_posts(stats, key, now=None):
+    entry = stats.get(key)
+    if entry is None or entry['last_visit'] is None:
+        return float('inf')
+    now = now or datetime.datetime.now()
+    since_visit = (now - datetime.datetime.strptime(entry['last_visit'], TIME_FORMAT)).total_seconds() / 3600
+    return since_visit / entry['gap_hours']
+
+
+def frontier(stats, jobs, min_expected=0.5, now=None):
+    # (person, extension) jobs worth a page load, most expected new posts first
+    scored = [(expected_new_posts(stats, f'{person}/{extension}', now), (person, extension))
+              for person, extension in jobs]
+    scored = [item for item in scored if item[0] >= min_expected]
+    scored.sort(key=lambda item: -item[0])
+    return [job for _, job in scored]
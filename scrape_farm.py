@@ -0,0 +1,137 @@
+import asyncio
+import multiprocessing
+import queue
+
+from playwright.async_api import async_playwright
+
+import metrics
+import scrape_linkedin
+from seen_posts import SeenPosts
+
+# Process pool mode of scrape_linkedin.main (`settings: workers:` above 1).
+# Every worker process runs its own chromium with a slice of the accounts and
+# takes (person, extension) jobs from a shared queue. Parsing and browser
+# driving get a core per worker, the results stream back into the parent's
+# dedupe -> classify -> store pipeline, the only writer of posts.db.
+
+# How often the parent checks for workers that died without saying so
+POLL_SECONDS = 1
+
+
+def split_accounts(quotas, workers):
+    # Round robin from the biggest quota down so the slices get similar totals
+    slices = [{} for _ in range(min(workers, len(quotas)))]
+    for i, (username, remaining) in enumerate(sorted(quotas.items(), key=lambda item: -item[1])):
+        slices[i % len(slices)][username] = remaining
+    return slices
+
+
+async def work(quotas, jobs, results):
+    saved_keys = set()
+    blacklist = scrape_linkedin.config['blacklist']
+    loop = asyncio.get_running_loop()
+    lag_watch = asyncio.create_task(metrics.watch_loop_lag())
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        await scrape_linkedin.login_accounts(browser, quotas)
+        scheduler = scrape_linkedin.make_scheduler(browser, quotas)
+
+        async def consume():
+            while True:
+                job = await loop.run_in_executor(None, jobs.get)
+                if job is None:
+                    # Leave the end marker for the other consumers
+                    jobs.put(None)
+                    return
+                person, extension, watermark = job
+                result = await scheduler.run(scrape_linkedin.scrape_person, person, extension, saved_keys, blacklist,
+                                             set(watermark))
+                if result is None:
+                    # This slice is out of uses, another worker can take it
+                    jobs.put(job)
+                    return
+                results.put(result)
+
+        # Enough consumers to fill every account up to its highest limit
+        consumers = sum(int(account['limiter'].max_concurrency) for account in scheduler.accounts.values())
+        await asyncio.gather(*[consume() for _ in range(consumers)])
+
+        remaining = {name: account['remaining'] for name, account in scheduler.accounts.items()}
+        await scheduler.close()
+        await browser.close()
+    lag_watch.cancel()
+    metrics.print_summary()
+    return remaining
+
+
+def worker_main(worker, quotas, jobs, results):
+    remaining = quotas
+    try:
+        remaining = asyncio.run(work(quotas, jobs, results))
+    finally:
+        results.put({'done': worker, 'remaining': remaining})
+
+
+async def run_farm(jobs, workers, visited_profiles=None, watermarks=None, revisit_stats=None, outcomes=None):
+    # Scrapes the (person, extension, watermark) jobs, best first, as far as
+    # the accounts' uses go. Returns the remaining uses per account, the
+    # other arguments get updated from the results (see make_pipeline).
+    quotas = scrape_linkedin.refresh_quotas()
+    slices = split_accounts(quotas, workers)
+    if not slices:
+        return {}
+    jobs = jobs[:sum(quotas.values())]
+
+    context = multiprocessing.get_context('spawn')
+    job_queue = context.Queue()
+    result_queue = context.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    job_queue.put(None)
+
+    processes = [context.Process(target=worker_main, args=(i, accounts, job_queue, result_queue),
+                                 name=f"Scrape worker {i}")
+                 for i, accounts in enumerate(slices)]
+    for process in processes:
+        process.start()
+
+    loop = asyncio.get_running_loop()
+    seen_posts = SeenPosts()
+    pipeline = scrape_linkedin.make_pipeline(seen_posts, visited_profiles, watermarks, revisit_stats, outcomes)
+    remaining = {}
+    done = set()
+    exited = set()
+    while len(done) < len(processes):
+        try:
+            result = await loop.run_in_executor(None, result_queue.get, True, POLL_SECONDS)
+        except queue.Empty:
+            # A worker killed from outside (OOM, chromium crash, SIGKILL)
+            # never sends its done message. One that has been gone for a whole
+            # poll counts as done, a message it sent before exiting would
+            # have come through by then. Its pages that didn't come back get
+            # released by settle_jobs, its uses stay as they were.
+            for i, process in enumerate(processes):
+                if i in done or process.is_alive():
+                    continue
+                if i in exited:
+                    print(f"{process.name} died with exit code {process.exitcode}")
+                    metrics.record('farm_dead_workers', 1)
+                    done.add(i)
+                    # In case it took the end marker with it
+                    job_queue.put(None)
+                exited.add(i)
+            continue
+        if 'done' in result:
+            done.add(result['done'])
+            remaining.update(result['remaining'])
+            continue
+
+        await pipeline.put(result)
+        metrics.record('farm_pages', 1)
+
+    await pipeline.close()
+    seen_posts.close()
+    for process in processes:
+        process.join()
+    return remaining
@@ -1,201 +1,540 @@
 import asyncio
+import functools
 from bs4 import BeautifulSoup
 import time
 import json
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
 
 from playwright.async_api import async_playwright, Page
+import metrics
 
 # Utility to scroll and wait
 
-
-async def scroll_page(page, steps=2, wait_time=1):
-    for _ in range(steps):
-        await page.evaluate("window.scrollTo(0, document.body.scrollHeight, {behavior:'smooth'});")
-        await asyncio.sleep(wait_time)
+LIST_SELECTOR = '.scaffold-finite-scroll__content ul'
+COUNT_ITEMS_JS = "(sel) => { const ul = document.querySelector(sel); return ul ? ul.children.length : 0; }"
+ITEMS_GREW_JS = "([sel, count]) => { const ul = document.querySelector(sel); return !!ul && ul.children.length > count; }"
+NEWEST_URN_JS = "(sel) => { const el = document.querySelector(sel + ' > li [data-urn]'); return el ? el.getAttribute('data-urn') : null; }"
+# How long the list gets to render after its data arrived or the network went quiet
+RENDER_GRACE = 0.5
+IDLE_TIME = 0.5
+# The voyager calls that load more activity posts (profileUpdatesV2, the
+# graphql profile updates query, the replay server's), lowercased. The page
+# makes plenty of others (messaging, badges, tracking) that say nothing
+# about the list.
+UPDATES_URL_PARTS = ('profileupdates', '/recent-activity/')
+
+
+def is_updates_request(url):
+    url = url.lower()
+    return '/voyager/api/' in url and any(part in url for part in UPDATES_URL_PARTS)
+
+
+async def wait_network_idle(inflight, started, idle_time=IDLE_TIME):
+    # Quiet for idle_time once the updates call started, before that the
+    # page hasn't begun loading the next posts
+    await started.wait()
+    quiet = 0
+    while quiet < idle_time:
+        await asyncio.sleep(0.05)
+        quiet = 0 if inflight else quiet + 0.05
+
+
+async def scroll_page(page, steps=2, wait_time=5, selector=LIST_SELECTOR):
+    # Scrolls to the bottom and waits until more list items show up, the
+    # activity updates call started by the scroll finishes or the network
+    # goes quiet after it. wait_time is only the fallback timeout. Returns the
+    # seconds spent waiting and whether the list grew.
+    # Unfinished requests started after the current scroll, ones from before
+    # it (long polls, earlier loads) don't count
+    inflight = set()
+    started = asyncio.Event()
+    updates_done = asyncio.Event()
+    scrolling = False
+
+    def on_request(request):
+        if scrolling:
+            inflight.add(request)
+            if is_updates_request(request.url):
+                started.set()
+
+    def on_request_done(request):
+        if request in inflight:
+            inflight.discard(request)
+            if is_updates_request(request.url):
+                updates_done.set()
+
+    page.on('request', on_request)
+    page.on('requestfinished', on_request_done)
+    page.on('requestfailed', on_request_done)
+    waited = 0
+    list_grew = False
+    try:
+        for _ in range(steps):
+            scrolling = False
+            count = await page.evaluate(COUNT_ITEMS_JS, selector)
+            inflight.clear()
+            started.clear()
+            updates_done.clear()
+            start = time.perf_counter()
+            scrolling = True
+            await page.evaluate("window.scrollTo(0, document.body.scrollHeight, {behavior:'smooth'});")
+
+            grew = asyncio.create_task(page.wait_for_function(
+                ITEMS_GREW_JS, arg=[selector, count], timeout=wait_time * 1000))
+            signals = [grew, asyncio.create_task(updates_done.wait()),
+                       asyncio.create_task(wait_network_idle(inflight, started))]
+            done, _ = await asyncio.wait(signals, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+            if done and grew not in done:
+                await asyncio.wait([grew], timeout=RENDER_GRACE)
+            if grew.done() and not grew.cancelled() and grew.exception() is None:
+                list_grew = True
+            for signal in signals:
+                signal.cancel()
+            await asyncio.gather(*signals, return_exceptions=True)
+            waited += time.perf_counter() - start
+    finally:
+        page.remove_listener('request', on_request)
+        page.remove_listener('requestfinished', on_request_done)
+        page.remove_listener('requestfailed', on_request_done)
     await page.evaluate("window.scrollTo(0, 0);")
+    return waited, list_grew
+
+
+# Resource blocking for scrape contexts. Image requests are aborted on the
+# network level only, the <img> tags and their src stay in the DOM.
+BLOCK_RESOURCE_TYPES = ('image', 'media', 'font')
+BLOCK_URL_PARTS = ('google-analytics.com', 'googletagmanager.com', 'doubleclick.net',
+                   'px.ads.linkedin.com', 'snap.licdn.com', 'linkedin.com/li/track',
+                   'bat.bing.com', 'connect.facebook.net', 'scorecardresearch.com')
+# Rough transfer size of a blocked request, the route handler never sees the
+# response so bytes saved can only be estimated
+AVG_RESOURCE_BYTES = {'image': 40000, 'media': 800000, 'font': 40000, 'script': 30000}
+OTHER_RESOURCE_BYTES = 2000
+
+
+async def block_resources(context, policy={}):
+    # Installs the blocking route on the context, returns the counters it fills
+    types = set(policy.get('resource_types', BLOCK_RESOURCE_TYPES))
+    url_parts = tuple(policy.get('url_parts', BLOCK_URL_PARTS))
+    stats = {'requests': 0, 'bytes': 0}
+
+    async def handle(route):
+        request = route.request
+        if request.resource_type in types or any(part in request.url for part in url_parts):
+            stats['requests'] += 1
+            stats['bytes'] += AVG_RESOURCE_BYTES.get(request.resource_type, OTHER_RESOURCE_BYTES)
+            await route.abort('blockedbyclient')
+        else:
+            await route.continue_()
 
+    if policy.get('enabled', True):
+        await context.route('**/*', handle)
+    return stats
 
-async def fetch_posts(page, saved_keys, blacklist=[]):
-    # await scroll_page(page)
-    print("Scraping posts\n")
-    content = await page.inner_html('.scaffold-finite-scroll__content')
-    soup = BeautifulSoup(content, 'html.parser')
+
+def record_blocked(stats):
+    metrics.record('blocked_requests', stats['requests'])
+    metrics.record('blocked_bytes_estimate', stats['bytes'])
+    stats['requests'] = 0
+    stats['bytes'] = 0
+
+
+# Snapshots of scraped lists, replay_server.py serves them back
+RECORDINGS_FOLDER = 'recordings'
+
+
+async def record_snapshot(page, name, selector=LIST_SELECTOR):
+    html = await page.inner_html(selector, timeout=5000)
+    file_name = os.path.join(RECORDINGS_FOLDER, name + '.html')
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, 'w', encoding='utf-8') as file:
+        file.write(html)
+    return file_name
+
+
+# Extraction schema shared by the feed and the activity page parsers.
+# field -> (tag, class, which match to keep). A class containing a space has
+# to match the whole class attribute, like BeautifulSoup's class_ does.
+POST_SCHEMA = {
+    'feed_content': ('div', 'feed-shared-inline-show-more-text', 'first'),
+    'content': ('span', 'break-words tvm-parent-container', 'first'),
+    'update': ('div', 'feed-shared-update-v2', 'first'),
+    'actor': ('div', 'update-components-actor__container', 'first'),
+    'img_wrapper': ('div', 'ivm-view-attr__img-wrapper', 'last'),
+    'name': ('span', 'update-components-actor__title', 'first'),
+    'rank': ('span', 'update-components-actor__supplementary-actor-info', 'first'),
+    'description': ('span', 'update-components-actor__description', 'first'),
+    'time_posted': ('span', 'update-components-actor__sub-description', 'first'),
+}
+
+
+def compile_schema(schema):
+    compiled = {}
+    for field, (tag, cls, keep) in schema.items():
+        compiled.setdefault(tag, []).append(
+            (field, cls, ' ' in cls, keep == 'last'))
+    return compiled
+
+
+COMPILED_POST_SCHEMA = compile_schema(POST_SCHEMA)
+
+
+def match_fields(nodes, compiled=COMPILED_POST_SCHEMA):
+    # Picks up every schema field from one walk over (tag, classes, node)
+    found = {}
+    for tag, classes, node in nodes:
+        rules = compiled.get(tag)
+        if rules is None or not classes:
+            continue
+        joined = None
+        for field, cls, whole, last in rules:
+            if not last and field in found:
+                continue
+            if whole:
+                if joined is None:
+                    joined = ' '.join(classes)
+                if joined == cls:
+                    found[field] = node
+            elif cls in classes:
+                found[field] = node
+    return found
+
+
+# PARSER BACKENDS
+# The parsers only talk to the tree through these methods, so every backend
+# has to return the same post dicts. benchmark_scrape.py checks that.
+
+
+class SoupBackend:
+    name = 'html.parser'
+
+    def person_items(self, html):
+        return BeautifulSoup(html, 'html.parser').find_all("li", recursive=False)
+
+    def feed_items(self, html):
+        return BeautifulSoup(html, 'html.parser').select("[data-finite-scroll-hotkey-item]")
+
+    def fields(self, node):
+        return match_fields((child.name, child.get('class'), child)
+                            for child in node.descendants if child.name is not None)
+
+    def get(self, node, attr, default=None):
+        return node.get(attr, default)
+
+    def find(self, node, tag):
+        return node.find(tag)
+
+    def text(self, node, br=''):
+        if br:
+            for elem in node.find_all('br'):
+                elem.replace_with(br)
+        return node.text
+
+    def stripped_text(self, node):
+        return node.get_text(strip=True)
+
+    def size(self, node):
+        return len(node)
+
+
+ASCII_SPACES = str.maketrans('', '', '\x20\x0a\x09\x0c\x0d')
+# BeautifulSoup keeps the strings of these tags out of .text
+SKIPPED_STRING_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+
+class LxmlBackend:
+    name = 'lxml'
+
+    def person_items(self, html):
+        return lxml.html.fragment_fromstring(html, create_parent='ul').findall('li')
+
+    def feed_items(self, html):
+        root = lxml.html.fragment_fromstring(html, create_parent='div')
+        return root.xpath('.//*[@data-finite-scroll-hotkey-item]')
+
+    def fields(self, node):
+        return match_fields((child.tag, child.get('class', '').split(), child)
+                            for child in node.iterdescendants() if isinstance(child.tag, str))
+
+    def get(self, node, attr, default=None):
+        return node.get(attr, default)
+
+    def find(self, node, tag):
+        return next(node.iterdescendants(tag), None)
+
+    def string(self, text):
+        # BeautifulSoup squashes whitespace only strings into one character
+        if text.translate(ASCII_SPACES):
+            return text
+        return '\n' if '\n' in text else ' '
+
+    def strings(self, node, br=''):
+        # Same strings BeautifulSoup's .text joins, comments left out
+        if node.text:
+            yield self.string(node.text)
+        for child in node:
+            if child.tag == 'br':
+                yield br
+            elif isinstance(child.tag, str) and child.tag not in SKIPPED_STRING_TAGS:
+                yield from self.strings(child, br)
+            if child.tail:
+                yield self.string(child.tail)
+
+    def text(self, node, br=''):
+        return ''.join(self.strings(node, br))
+
+    def stripped_text(self, node):
+        return ''.join(string.strip() for string in self.strings(node) if string.strip())
+
+    def size(self, node):
+        # BeautifulSoup counts text nodes as children too
+        count = 1 if node.text else 0
+        for child in node:
+            count += 2 if child.tail else 1
+        return count
+
+
+PARSER_BACKENDS = {'html.parser': SoupBackend, 'lxml': LxmlBackend}
+parser_backend = SoupBackend()
+
+# 'html' copies the list html out of the page and parses it here, 'browser'
+# runs extract_posts.js inside the page and only gets the post dicts back,
+# 'api' decodes the voyager json the page loads its posts from and falls
+# back to 'html' when nothing was captured
+EXTRACTION_MODES = ('html', 'browser', 'api')
+extraction_mode = 'html'
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_posts.js'), encoding='utf-8') as js_file:
+    EXTRACT_POSTS_JS = js_file.read()
+
+
+def set_parser_backend(name):
+    global parser_backend
+    if name not in PARSER_BACKENDS:
+        raise Exception("Unknown parser backend " + str(name))
+    if name == 'lxml' and lxml is None:
+        raise Exception("The lxml parser backend needs the lxml package")
+    parser_backend = PARSER_BACKENDS[name]()
+    return parser_backend
+
+
+def set_extraction_mode(mode):
+    global extraction_mode
+    if mode not in EXTRACTION_MODES:
+        raise Exception("Unknown extraction mode " + str(mode))
+    extraction_mode = mode
+    return extraction_mode
+
+
+# Parsing a loaded page blocks the event loop (and every other page's
+# navigation and scroll timers) for a good fraction of a second. With
+# parse_workers set the html goes to a process pool instead, only the html
+# string and the post dicts cross over.
+parse_workers = 0
+parse_pool = None
+
+
+def set_parse_workers(count):
+    global parse_workers, parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False)
+        parse_pool = None
+    parse_workers = count
+    return parse_workers
+
+
+def parse_html(parse, html, saved_keys, blacklist, backend_name):
+    # Runs in the parse pool
+    return parse(html, saved_keys, blacklist, PARSER_BACKENDS[backend_name]())
+
+
+async def run_parse(parse, html, saved_keys, blacklist=[]):
+    global parse_pool
+    if not parse_workers:
+        return parse(html, saved_keys, blacklist)
+    if parse_pool is None:
+        # spawn, forking next to playwright's threads isn't safe
+        parse_pool = ProcessPoolExecutor(parse_workers, mp_context=multiprocessing.get_context('spawn'))
+    posts, _ = await asyncio.get_running_loop().run_in_executor(
+        parse_pool, parse_html, parse, html, saved_keys, blacklist, parser_backend.name)
+    # The pool worked on a copy of saved_keys
+    saved_keys.update(post['data_id'] for post in posts)
+    return posts, saved_keys
+
+
+def parse_posts(content, saved_keys, blacklist=[], backend=None):
+    tree = backend or parser_backend
 
     posts = []
     iter = 0
 
-    for post_div in soup.select("[data-finite-scroll-hotkey-item]"):
+    for post_div in tree.feed_items(content):
         post_data = {}
+        fields = tree.fields(post_div)
 
-        post_content = post_div.find(
-            'div', class_='feed-shared-inline-show-more-text')
-        if not post_content:
+        post_content = fields.get('feed_content')
+        if post_content is None:
             iter += 1
             print("skipped no_content", iter)
             continue
 
-        data_id = post_content.get_text(strip=True)[:35]
-        if data_id == "" or len(post_div.get('data-id', "")) > 35 or (data_id in saved_keys):
+        data_id = tree.stripped_text(post_content)[:35]
+        if data_id == "" or len(tree.get(post_div, 'data-id', "")) > 35 or (data_id in saved_keys):
             iter += 1
             print("skipped not_a_post", iter)
             continue
 
-        profile_link_div = post_div.find(
-            'div', class_='update-components-actor__container')
-        if not profile_link_div:
+        profile_link_div = fields.get('actor')
+        if profile_link_div is None:
             iter += 1
             continue
 
-        profile_link_tag = profile_link_div.find('a')
-        if not profile_link_tag:
+        profile_link_tag = tree.find(profile_link_div, 'a')
+        if profile_link_tag is None:
             iter += 1
             continue
 
-        profile_href_parts = profile_link_tag.get('href').split("/")
+        profile_href_parts = tree.get(profile_link_tag, 'href').split("/")
         if (profile_href_parts[3] in blacklist) or (profile_href_parts[4].split("?")[0] in blacklist):
             iter += 1
             continue
 
         saved_keys.add(data_id)
-        post_data['embeding_url'] = post_div.get('data-id')
-        post_data['profile_link'] = profile_link_tag.get('href')
+        post_data['embeding_url'] = tree.get(post_div, 'data-id')
+        post_data['profile_link'] = tree.get(profile_link_tag, 'href')
         post_data['data_id'] = data_id
         post_data['id'] = iter
 
-        img = post_div.find_all('div', class_="ivm-view-attr__img-wrapper")
-        if img and img[-1].find('img'):
-            post_data['img_link'] = img[-1].find('img').get('src')
+        img = fields.get('img_wrapper')
+        if img is not None and tree.find(img, 'img') is not None:
+            post_data['img_link'] = tree.get(tree.find(img, 'img'), 'src')
 
-        name = post_div.find('span', class_='update-components-actor__title')
-        post_data['name'] = name.find('span').get_text(
-            strip=True)[:len(name)//2] if name else ""
+        name = fields.get('name')
+        post_data['name'] = tree.stripped_text(tree.find(name, 'span'))[
+            :tree.size(name)//2] if name is not None else ""
 
-        rank = post_div.find(
-            'span', class_='update-components-actor__supplementary-actor-info')
-        post_data['rank'] = rank.get_text(
-            strip=True)[:len(rank)//2] if rank else ""
+        rank = fields.get('rank')
+        post_data['rank'] = tree.stripped_text(
+            rank)[:tree.size(rank)//2] if rank is not None else ""
 
-        desc = post_div.find(
-            'span', class_='update-components-actor__description')
-        post_data['description'] = desc.get_text(
-            strip=True)[:len(desc)//2] if desc else ""
+        desc = fields.get('description')
+        post_data['description'] = tree.stripped_text(
+            desc)[:tree.size(desc)//2] if desc is not None else ""
 
-        time_posted = post_div.find(
-            'span', class_='update-components-actor__sub-description')
-        post_data['time_posted'] = time_posted.get_text(
-            strip=True) if time_posted else ""
+        time_posted = fields.get('time_posted')
+        post_data['time_posted'] = tree.stripped_text(
+            time_posted) if time_posted is not None else ""
 
-        for br in post_content.find_all('br'):
-            br.replace_with('\n')
-
-        post_data['post_text'] = post_content.text[:-9]
+        post_data['post_text'] = tree.text(post_content, br='\n')[:-9]
         posts.append(post_data)
         iter += 1
 
     return posts, saved_keys
 
 
-async def fetch_posts_person(page, person, extension, saved_keys, blacklist=[]):
-    await scroll_page(page)
-    print("Scrapping " + person + " " + extension)
-    try:
-        html = await page.inner_html(selector='.scaffold-finite-scroll__content ul', timeout=60000)
-    except:
-        print(await page.url)
-        print("Error finding the person")
-        return
-    soup = BeautifulSoup(html, 'html.parser')
+def filter_voyager_posts(rows, saved_keys, blacklist=[]):
+    posts = []
+    for post_data in rows:
+        data_id = post_data['data_id']
+        if data_id == "" or data_id in saved_keys:
+            continue
+        profile_href_parts = post_data['profile_link'].split("/")
+        if (profile_href_parts[3] in blacklist) or (profile_href_parts[4].split("?")[0] in blacklist):
+            continue
+        saved_keys.add(data_id)
+        posts.append(post_data)
+    return posts, saved_keys
+
+
+async def fetch_posts(page, saved_keys, blacklist=[], captured=None):
+    # await scroll_page(page)
+    print("Scraping posts\n")
+    if extraction_mode == 'api' and captured:
+        rows = parse_voyager_updates(captured)
+        if rows:
+            return filter_voyager_posts(rows, saved_keys, blacklist)
+    content = await page.inner_html('.scaffold-finite-scroll__content')
+    return await run_parse(parse_posts, content, saved_keys, blacklist)
+
+
+def parse_posts_person(html, saved_keys, blacklist=[], backend=None, first_id=0):
+    tree = backend or parser_backend
 
     posts = []
-    iter = 0
+    iter = first_id
 
-    for post_div in soup.find_all("li", recursive=False):
+    for post_div in tree.person_items(html):
         post_data = {}
+        fields = tree.fields(post_div)
 
-        content = post_div.find(
-            "span", class_="break-words tvm-parent-container")
-        if not content:
-            iter += 1
-        if not content:
-            iter += 1
-
-        content = post_div.find(
-            "span", class_="break-words tvm-parent-container")
-        if not content:
-            iter += 1
-            iter += 1
-        if not content:
-            iter += 1
-            iter += 1
+        content = fields.get('content')
+        if content is None:
+            # Empty list items used to bump the counter 9 times, ids stay as they were
+            iter += 9
+            continue
 
-        content = post_div.find(
-            "span", class_="break-words tvm-parent-container")
-        if not content:
-            iter += 1
-        if not content:
-            iter += 1
+        post_id_elem = fields.get('update')
+        if post_id_elem is None:
             iter += 1
+            print("skipped not_a_post", iter)
             continue
 
-        post_id_elem = post_div.find_all(
-            'div', class_="feed-shared-update-v2")[0]
-        data_id = content.text.strip()[:35]
-        if (data_id in saved_keys) or len(post_id_elem.get('data-id', "")) > 35:
+        data_id = tree.text(content).strip()[:35]
+        if (data_id in saved_keys) or len(tree.get(post_id_elem, 'data-id', "")) > 35:
             iter += 1
             print("skipped no_content", iter)
             continue
 
-        profile_link_div = post_div.find(
-            'div', class_='update-components-actor__container')
-        if not profile_link_div:
+        profile_link_div = fields.get('actor')
+        if profile_link_div is None:
             iter += 1
             print("skipped not_a_post", iter)
             continue
 
-        profile_link_tag = profile_link_div.find('a')
-        if not profile_link_tag:
+        profile_link_tag = tree.find(profile_link_div, 'a')
+        if profile_link_tag is None:
             iter += 1
             continue
 
-        profile_href_parts = profile_link_tag.get('href').split("/")
+        profile_href_parts = tree.get(profile_link_tag, 'href').split("/")
         if (profile_href_parts[3] in blacklist) or (profile_href_parts[4].split("?")[0] in blacklist):
             iter += 1
             continue
 
         saved_keys.add(data_id)
-        post_data['profile_link'] = profile_link_tag.get('href')
-
-        for br in content.find_all('br'):
-            br.replace_with('\n')
+        post_data['profile_link'] = tree.get(profile_link_tag, 'href')
 
-        if post_div.find("div", class_="feed-shared-update-v2"):
-            data_urn_div = post_div.find("div", class_="feed-shared-update-v2")
-            post_data['embeding_url'] = data_urn_div.get("data-urn")
-        post_data['post_text'] = content.text[:-9]
+        post_data['embeding_url'] = tree.get(post_id_elem, "data-urn")
+        post_data['post_text'] = tree.text(content, br='\n')[:-9]
         post_data['data_id'] = data_id
         post_data['id'] = iter
 
-        img = post_div.find_all('div', class_="ivm-view-attr__img-wrapper")
-        if img and img[-1].find('img'):
-            post_data['img_link'] = img[-1].find('img').get('src')
+        img = fields.get('img_wrapper')
+        if img is not None and tree.find(img, 'img') is not None:
+            post_data['img_link'] = tree.get(tree.find(img, 'img'), 'src')
 
-        name = post_div.find('span', class_='update-components-actor__title')
-        post_data['name'] = name.find('span').get_text(
-            strip=True) if name else ""
+        name = fields.get('name')
+        post_data['name'] = tree.stripped_text(
+            tree.find(name, 'span')) if name is not None else ""
 
-        rank = post_div.find(
-            'span', class_='update-components-actor__supplementary-actor-info')
-        post_data['rank'] = rank.get_text(strip=True) if rank else ""
+        rank = fields.get('rank')
+        post_data['rank'] = tree.stripped_text(
+            rank) if rank is not None else ""
 
-        desc = post_div.find(
-            'span', class_='update-components-actor__description')
-        post_data['description'] = desc.get_text(
-            strip=True)[:len(desc)//2] if desc else ""
+        desc = fields.get('description')
+        post_data['description'] = tree.stripped_text(
+            desc)[:tree.size(desc)//2] if desc is not None else ""
 
-        time_posted = post_div.find(
-            'span', class_='update-components-actor__sub-description')
-        post_data['time_posted'] = time_posted.get_text(
-            strip=True) if time_posted else ""
+        time_posted = fields.get('time_posted')
+        post_data['time_posted'] = tree.stripped_text(
+            time_posted) if time_posted is not None else ""
 
         posts.append(post_data)
         iter += 1
@@ -203,6 +542,212 @@ async def fetch_posts_person(page, person, extension, saved_keys, blacklist=[]):
     return posts, saved_keys
 
 
+# VOYAGER API RESPONSES
+
+VOYAGER_UPDATE_TYPES = ('com.linkedin.voyager.dash.feed.Update',
+                        'com.linkedin.voyager.feed.render.UpdateV2')
+
+
+@contextmanager
+def capture_voyager(page):
+    # Collects the json of every voyager api response while in 'api' mode
+    payloads = []
+
+    async def on_response(response):
+        if '/voyager/api/' not in response.url or 'json' not in response.headers.get('content-type', ''):
+            return
+        try:
+            payloads.append(await response.json())
+        except Exception as e:
+            print(e)
+
+    if extraction_mode != 'api':
+        yield payloads
+        return
+    page.on('response', on_response)
+    try:
+        yield payloads
+    finally:
+        page.remove_listener('response', on_response)
+
+
+def walk_json(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from walk_json(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from walk_json(value)
+
+
+def view_text(model):
+    # Voyager TextViewModel -> plain text
+    return (model.get('text') or '') if isinstance(model, dict) else ''
+
+
+def actor_image(actor):
+    for attribute in (actor.get('image') or {}).get('attributes', []):
+        for picture in walk_json(attribute):
+            vector = picture.get('vectorImage')
+            if vector and vector.get('artifacts'):
+                return vector.get('rootUrl', '') + vector['artifacts'][0]['fileIdentifyingUrlPathSegment']
+    return None
+
+
+def voyager_post(update, id):
+    actor = update.get('actor') or {}
+    profile_link = (actor.get('navigationContext') or {}).get('actionTarget')
+    text = view_text((update.get('commentary') or {}).get('text'))
+    if not text or not profile_link:
+        return None
+
+    urn = (update.get('metadata') or {}).get('backendUrn') or (update.get('updateMetadata') or {}).get('urn')
+    post_data = {
+        'profile_link': profile_link,
+        'embeding_url': urn,
+        'post_text': text,
+        # The html text has no line breaks, keep the keys comparable
+        'data_id': text.replace('\n', '').strip()[:35],
+        'id': id,
+    }
+    img_link = actor_image(actor)
+    if img_link:
+        post_data['img_link'] = img_link
+    post_data['name'] = view_text(actor.get('name')).strip()
+    post_data['rank'] = view_text(actor.get('supplementaryActorInfo')).strip()
+    post_data['description'] = view_text(actor.get('description')).strip()
+    post_data['time_posted'] = view_text(actor.get('subDescription')).strip()
+    return post_data
+
+
+def parse_voyager_updates(payloads):
+    # Post dicts in the order the page shows them. Normalized responses keep
+    # the order in the '*elements' urn lists, the entities sit in 'included'
+    updates = {}
+    order = []
+    for payload in payloads:
+        for node in walk_json(payload):
+            if node.get('$type') in VOYAGER_UPDATE_TYPES:
+                updates.setdefault(node.get('entityUrn'), node)
+            for urn in node.get('*elements', []):
+                if isinstance(urn, str) and urn not in order:
+                    order.append(urn)
+    order = [urn for urn in order if urn in updates]
+    order += [urn for urn in updates if urn not in order]
+
+    posts = []
+    for id, urn in enumerate(order):
+        post_data = voyager_post(updates[urn], id)
+        if post_data:
+            posts.append(post_data)
+    return posts
+
+
+async def extract_posts_person(page, selector, timeout=60000, start=0, first_id=0, html=False):
+    # Runs the bundled extractor on the first element matching selector, see
+    # extract_posts.js for what comes back
+    options = {'schema': POST_SCHEMA, 'start': start, 'firstId': first_id, 'html': html}
+    return await page.locator(selector).first.evaluate(EXTRACT_POSTS_JS, options, timeout=timeout)
+
+
+async def extract_rows_person(page, captured=None, state=None):
+    # Posts rendered in the activity list since the last call with the same
+    # state (all of them without one), saved_keys and the blacklist not
+    # applied yet. Only the new list items get copied out and parsed, their
+    # ids carry on from the earlier ones.
+    if state is None:
+        state = {'items': 0, 'next_id': 0}
+    if extraction_mode == 'api' and captured:
+        rows = parse_voyager_updates(captured)
+        if rows:
+            return rows
+    found = await extract_posts_person(page, LIST_SELECTOR, start=state['items'], first_id=state['next_id'],
+                                       html=extraction_mode != 'browser')
+    if extraction_mode == 'browser':
+        rows = found['posts']
+    else:
+        rows, _ = await run_parse(functools.partial(parse_posts_person, first_id=state['next_id']),
+                                  found['html'], set())
+    state['items'], state['next_id'] = found['items'], found['nextId']
+    return rows
+
+
+async def newest_urn(page):
+    # urn of the first post in the activity list, None if it can't be read
+    try:
+        await page.wait_for_selector(LIST_SELECTOR, timeout=60000)
+        return await page.evaluate(NEWEST_URN_JS, LIST_SELECTOR)
+    except Exception as e:
+        print(e)
+        return None
+
+
+async def fetch_posts_person(page, person, extension, saved_keys, blacklist=[], watermark=(), max_scrolls=10, captured=None):
+    # Yields the posts of an activity page as they get rendered. The list is
+    # newest first, so scrolling stops at the first post that is already in
+    # saved_keys or in the watermark (urns seen on the last run), when the
+    # list stops growing (a scroll and one retry added nothing), or after
+    # max_scrolls scrolls. Posts are
+    # keyed by urn, data ids are text prefixes that collide and only stand in
+    # for posts without one. captured holds the voyager payloads of the page
+    # in 'api' mode.
+    print("Scrapping " + person + " " + extension)
+    page_keys = set()
+    extracted = {'items': 0, 'next_id': 0}
+    waited = 0
+
+    if watermark and await newest_urn(page) in watermark:
+        # Nothing new since the last run, don't copy out or parse the list
+        print("No new posts from " + person + " " + extension)
+        metrics.record('unchanged_pages', 1)
+        return
+
+    try:
+        for step in range(max_scrolls + 1):
+            grew = False
+            if step:
+                seconds, grew = await scroll_page(page, steps=1)
+                waited += seconds
+                if not grew:
+                    # Slow loads happen, one more wait before calling it the
+                    # end of the list
+                    seconds, grew = await scroll_page(page, steps=1)
+                    waited += seconds
+            try:
+                rows = await extract_rows_person(page, captured, extracted)
+            except:
+                print(page.url)
+                print("Error finding the person")
+                # Let the caller count it as a failed extraction
+                raise
+
+            found_new = False
+            for post_data in rows:
+                key = post_data.get('embeding_url') or post_data['data_id']
+                if key in page_keys:
+                    continue
+                if key in saved_keys or key in watermark:
+                    print("Reached already seen post", post_data['id'])
+                    return
+
+                page_keys.add(key)
+                found_new = True
+                profile_href_parts = post_data['profile_link'].split("/")
+                if (profile_href_parts[3] in blacklist) or (profile_href_parts[4].split("?")[0] in blacklist):
+                    continue
+
+                saved_keys.add(key)
+                yield post_data
+
+            # A grown list with nothing new in it (ads, suggestions) keeps
+            # going until max_scrolls
+            if not found_new and not grew:
+                return
+    finally:
+        metrics.record('page_wait_seconds', waited)
+
+
 async def scrape_link_only(page: Page, approved_posts, xpath):
     links = []
     print("Posts: \n\n")
@@ -2,15 +2,24 @@ import asyncio
 import json
 from playwright.async_api import async_playwright
 from playwright_stealth import stealth_async
-from asynciolimiter import Limiter
-from scrape_functions import fetch_posts, fetch_posts_person, scrape_link_only
+from scrape_functions import fetch_posts, fetch_posts_person, scrape_link_only, set_parser_backend, set_extraction_mode, set_parse_workers, block_resources, record_blocked, capture_voyager, record_snapshot
+from adaptive_limit import page_outcome
+from account_scheduler import AccountScheduler
+from pipeline import Stage
 import datetime
 import os
+import time
 import yaml
 import subprocess
+import weakref
 import Gpt_check_topic
+import revisit
 import aioconsole
-from multiprocessing import Queue
+import metrics
+from job_queue import JobQueue, RETRY_SECONDS
+from post_store import PostStore, post_urn
+from seen_posts import SeenPosts
+from near_dupes import NearDupes
 
 
 # Load the config
@@ -21,25 +30,61 @@ with open('config.yaml') as config_file:
 TIMEOUT = config['settings']['timeout']
 APPROVED_TOPICS = config['topics']  # Replace with your approved topics
 STALKLIST = config['stalklist']
+BLOCKING = config.get('blocking', {})
+ADAPTIVE_LIMIT = config['settings'].get('adaptive_limit', {})
+# Point this at replay_server.py to scrape recorded pages offline
+LINKEDIN_URL = config['settings'].get('base_url', 'https://www.linkedin.com')
+RECORD = config['settings'].get('record', False)
+# Classify posts while scraping so feeds are ready when the scrape ends
+CLASSIFY = config['settings'].get('classify', True)
+CLASSIFY_WORKERS = config['settings'].get('classify_workers', 4)
+# LLM requests in flight at once, over every stage worker and feed build
+LLM_CONCURRENCY = config['settings'].get('llm_concurrency', 8)
+PIPELINE_QUEUE_SIZE = config['settings'].get('pipeline_queue_size', 100)
+WATERMARK_DEPTH = 5
+# An account that used up its uses gets them back this long after the last reset
+QUOTA_RESET = datetime.timedelta(hours=25)
+ACCOUNT_USES = 147
+# Pages expected to have fewer new posts than this are left for a later run
+MIN_EXPECTED_POSTS = config['settings'].get('min_expected_posts', 0.5)
 PORT = 5000
+set_parser_backend(config['settings'].get('parser', 'html.parser'))
+set_extraction_mode(config['settings'].get('extraction', 'html'))
+set_parse_workers(config['settings'].get('parse_workers', 0))
 
 # LOGIN AND COOKIES SETUP
 
+FEED_URL = LINKEDIN_URL + '/feed**'
+CODE_INPUT = "xpath=//input[@placeholder = '6 digit code' or @placeholder = 'Enter code']"
+
+
+async def wait_for_login_step(page, selector=None, timeout=10000):
+    # Returns as soon as we land on the feed or selector shows up,
+    # the timeout is only a fallback
+    signals = [asyncio.create_task(page.wait_for_url(FEED_URL, timeout=timeout))]
+    if selector:
+        signals.append(asyncio.create_task(
+            page.wait_for_selector(selector, timeout=timeout)))
+    await asyncio.wait(signals, return_when=asyncio.FIRST_COMPLETED)
+    for signal in signals:
+        signal.cancel()
+    await asyncio.gather(*signals, return_exceptions=True)
+
 
 async def login_and_get_cookies(page, email, password, context):
     await load_cookies(context, email)
-    await page.goto('https://www.linkedin.com/login', timeout=60000)
-    await asyncio.sleep(3)
+    await page.goto(LINKEDIN_URL + '/login', timeout=60000)
+    await wait_for_login_step(page, '#username')
 
     # We have to login manually
-    if not page.url.startswith('https://www.linkedin.com/feed'):
+    if not page.url.startswith(LINKEDIN_URL + '/feed'):
         print("Cookies are invalid, logging in")
         elem = page.locator("#username")
         await elem.fill(email)
         elem = page.locator("#password")
         await elem.fill(password)
         await page.click('.btn__primary--large.from__button--floating')
-        await asyncio.sleep(3)
+        await wait_for_login_step(page, CODE_INPUT)
     else:
         print("Succesfully logged in")
         cookies = await page.context.cookies()
@@ -52,20 +97,19 @@ async def login_and_get_cookies(page, email, password, context):
 
     # We ran into an gmail code request
     # await page.wait_for_load_state('networkidle')
-    if not page.url.startswith('https://www.linkedin.com/feed'):
+    if not page.url.startswith(LINKEDIN_URL + '/feed'):
         try:
             line = await aioconsole.ainput('Enter the code that arrived in the email')
-            elem = page.locator(
-                "xpath=//input[@placeholder = '6 digit code' or @placeholder = 'Enter code']")
+            elem = page.locator(CODE_INPUT)
             await elem.fill(line)
             await page.keyboard.press('Enter')
-            await asyncio.sleep(3)
+            await wait_for_login_step(page)
         except Exception as e:
             print(e)
             print(await page.content())
 
     # Check if we failed
-    if page.url.startswith('https://www.linkedin.com/feed'):
+    if page.url.startswith(LINKEDIN_URL + '/feed'):
         print("Logged in")
     else:
         print("Error on loggin")
@@ -90,110 +134,168 @@ async def load_cookies(context, username):
         return False
 
 
-async def load_new_account(browser, loading_next=False):
+def quota_reset_at(profile):
+    return datetime.datetime.strptime(profile['last_used_date'], '%Y-%m-%d %H:%M:%S') + QUOTA_RESET
+
+
+def refresh_quotas():
+    # Remaining uses of every account that can scrape, {username: remaining_uses}
     file_name = "acc_usage_tracking.json"
     if os.path.exists(file_name):
         with open(file_name, "r") as file:
             profiles = json.load(file)
     else:
-        return -1, None
+        return {}
 
-    if(not "profile_id" in os.environ):
-        os.environ["profile_id"] = "0"
-    profile_index = int(os.environ["profile_id"])
+    quotas = {}
+    for profile in profiles:
+        if profile['remaining_uses'] == 0:
+            if datetime.datetime.now() >= quota_reset_at(profile):
+                profile['last_used_date'] = datetime.datetime.now().strftime(
+                    "%Y-%m-%d %H:%M:%S")
+                profile['remaining_uses'] = ACCOUNT_USES
+            else:
+                continue
 
-    if loading_next:
-        profiles[profile_index]['remaining_uses'] = 0
-        profile_index = (profile_index+1) % len(profiles)
-        os.environ["profile_id"] = str(profile_index)
-
-    if profiles[profile_index]['remaining_uses'] == 0:
-        if int((datetime.datetime.strptime(profiles[profile_index]['last_used_date'], '%Y-%m-%d %H:%M:%S') - datetime.datetime.now()).total_seconds()//(3600)) >= 25:
-            profiles[profile_index]['last_used_date'] = datetime.datetime.now().strftime(
-                "%Y-%m-%d %H:%M:%S")
-            profiles[profile_index]['remaining_uses'] = 147
-        else:
-            return -1, None
+        username = profile['name']
+        if config['credentials'].get(username.split('@')[0]) is None:
+            print(f"No credentials for {username}, skipping it")
+            continue
+        quotas[username] = profile['remaining_uses']
 
     with open(file_name, "w") as file:
         json.dump(profiles, file, indent=4)
-    username = profiles[profile_index]['name']
-    if(config['credentials'].get(username.split('@')[0]) is None):
-        raise Exception("Error non existing username called")
+    return quotas
 
-    password = config['credentials'].get(username.split('@')[0])
 
-    context = await browser.new_context()
-    page = await context.new_page()
+def next_quota_reset():
+    # Seconds until the first used up account (with credentials) gets its
+    # uses back, None when there is none
+    file_name = "acc_usage_tracking.json"
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "r") as file:
+        profiles = json.load(file)
+    resets = [quota_reset_at(profile) for profile in profiles
+              if profile['remaining_uses'] == 0 and config['credentials'].get(profile['name'].split('@')[0]) is not None]
+    if not resets:
+        return None
+    return max(0, (min(resets) - datetime.datetime.now()).total_seconds())
 
-    await stealth_async(page)
-    await login_and_get_cookies(page, username, password, context)
-    await context.close()
 
-    return profiles[profile_index]['remaining_uses'], username
+async def login_accounts(browser, quotas):
+    for username in quotas:
+        password = config['credentials'].get(username.split('@')[0])
+
+        context = await browser.new_context()
+        page = await context.new_page()
 
+        await stealth_async(page)
+        await login_and_get_cookies(page, username, password, context)
+        await context.close()
 
-async def save_profile_counts(count):
-    if("profile_id" not in os.environ):
-        return
-    profile_index = int(os.environ['profile_id'])
 
+def make_scheduler(browser, quotas):
+    return AccountScheduler(browser, quotas,
+                            pool_options={'max_navigations': config['settings'].get('pool_max_navigations', 50),
+                                          'blocking': BLOCKING},
+                            limit_options=ADAPTIVE_LIMIT)
+
+
+async def save_profile_counts(remaining):
     file_name = "acc_usage_tracking.json"
-    if os.path.exists(file_name):
-        with open(file_name, "r") as file:
-            profiles = json.load(file)
-    profiles[profile_index]['remaining_uses'] = count
+    if not os.path.exists(file_name):
+        return
+    with open(file_name, "r") as file:
+        profiles = json.load(file)
+    for profile in profiles:
+        if profile['name'] in remaining:
+            profile['remaining_uses'] = remaining[profile['name']]
     with open(file_name, "w") as file:
         json.dump(profiles, file, indent=4)
 
 
 # SAVING AND LOADING POSTS
 
-def save_to_json(posts, person):
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    file_name = f"JSON_DATA/{person}_posts_{today}.json"
-    old_posts = []
+def dedupe_posts(posts, seen_posts, in_flight=()):
+    # Splits a page into new posts and ones seen on this or an earlier run
+    # (or already sent down the pipeline by an earlier page). Posts only
+    # count as seen once stored.
+    new, seen = [], []
+    keys = set()
+    for post in posts:
+        if not post['data_id']:
+            continue
+        key = post_urn(post)
+        if key in keys:
+            continue
+        keys.add(key)
+        if key in seen_posts or key in in_flight:
+            seen.append(post)
+        else:
+            new.append(post)
+    return new, seen
+
+
+def get_visited_profiles():
+    file_name = "visited_profiles.json"
     if os.path.exists(file_name):
         with open(file_name, 'r') as file:
-            old_posts = json.load(file)
-    with open(file_name, 'w') as file:
-        json.dump(posts+old_posts, file, indent=4)
-
-    return posts
+            scraped_people = json.load(file)
+            return scraped_people
+    else:
+        return dict()
 
 
-def load_visited_posts():
-    file_name = "visited_posts.json"
-    keys = {''}
-    existing_keys = []
+def load_watermarks():
+    # {'person/extension': newest post seen there on the last good scrape}
+    file_name = "watermarks.json"
     if os.path.exists(file_name):
         with open(file_name, 'r') as file:
-            existing_keys = json.load(file)
-    for key in existing_keys:
-        keys.add(key['key'])
-    return keys
+            return json.load(file)
+    return dict()
 
 
-def save_visited_posts(keys):
-    new_keys = []
-    file_name = "visited_posts.json"
-    for key in keys:
-        new_keys.append({'key': key})
+def save_watermarks(watermarks):
+    with open("watermarks.json", "w") as file:
+        json.dump(watermarks, file, indent=4)
 
-    with open(file_name, 'w') as file:
-        json.dump(new_keys, file, indent=4)
 
-    return new_keys
+def watermark_for(watermarks, person, extension):
+    mark = watermarks.get(f'{person}/{extension}')
+    return set(mark['recent']) if mark else set()
 
 
-def get_visited_profiles():
-    file_name = "visited_profiles.json"
-    if os.path.exists(file_name):
-        with open(file_name, 'r') as file:
-            scraped_people = json.load(file)
-            return scraped_people
-    else:
-        return dict()
+def update_watermark(watermarks, result):
+    # Only a complete scrape moves the watermark, after a failure the posts
+    # between the old watermark and the ones we got would never be scraped
+    if result.get('outcome') != 'ok' or not result['posts']:
+        return
+    newest = result['posts'][0]
+    recent = []
+    # A few posts deep, in case the newest one gets deleted. Data ids only
+    # for posts without an urn, they collide between different posts.
+    for post in result['posts'][:WATERMARK_DEPTH]:
+        recent.append(post.get('embeding_url') or post['data_id'])
+    watermarks[f"{result['person']}/{result['ext']}"] = {
+        'urn': newest.get('embeding_url'), 'data_id': newest['data_id'],
+        'seen_at': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'recent': recent}
+
+
+def settle_jobs(job_queue, people, due, outcomes):
+    # Done when every due page of the person got scraped, retried when one
+    # failed, back in the queue when the accounts ran out before their turn.
+    # People with no page due yet are done too, their data is recent enough.
+    for person in people:
+        pages = [page for page in due if page[0] == person]
+        results = outcomes.get(person, [])
+        failed = [outcome for outcome in results if outcome != 'ok']
+        if failed:
+            job_queue.fail(person, ', '.join(failed))
+        elif len(results) < len(pages):
+            job_queue.release([person])
+        else:
+            job_queue.complete([person])
 
 
 def save_visited_profiles(people):
@@ -214,16 +316,115 @@ def call_chatgpt_api(post_text):
     return Gpt_check_topic.check_topic(post_text)
 
 
-async def process_posts(posts, topics):
-    approved_posts = []
+# One per event loop, flask runs every async view in a loop of its own
+llm_slots = weakref.WeakKeyDictionary()
+
+
+def llm_slot():
+    loop = asyncio.get_running_loop()
+    if loop not in llm_slots:
+        llm_slots[loop] = asyncio.Semaphore(LLM_CONCURRENCY)
+    return llm_slots[loop]
+
+
+async def classify_post(post, topics):
+    # The verdict is kept on the post, posts classified while scraping don't
+    # go to the LLM again when the feed gets built
+    verdicts = post.setdefault('verdicts', {})
+    if str(topics) not in verdicts:
+        async with llm_slot():
+            verdicts[str(topics)] = 'post_text' in await Gpt_check_topic.check_topic(post, post.get('id'), topics)
+    return verdicts[str(topics)]
+
 
-    tasks = [Gpt_check_topic.check_topic(posts[i], i, topics) for i in range(
-        len(posts)) if 'post_text' in posts[i]]
-    responses = await asyncio.gather(*tasks)
-    approved_posts = [
-        response for response in responses if 'post_text' in response]
+async def process_posts(posts, topics):
+    posts = [post for post in posts if 'post_text' in post]
+    verdicts = await asyncio.gather(*[classify_post(post, topics) for post in posts])
+    approved_posts = [post for post, approved in zip(posts, verdicts) if approved]
     return approved_posts
 
+
+def wanted_prompts():
+    # {person: prompts of the user requests that include them}
+    prompts = {}
+    path = os.path.join("USER_REQUESTS", "requests.json")
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            for line in json.load(file):
+                for person in line['task']['people']:
+                    prompts.setdefault(person, set()).add(line['task']['prompt'])
+    return prompts
+
+
+def make_pipeline(seen_posts, visited_profiles=None, watermarks=None, revisit_stats=None, outcomes=None):
+    # dedupe -> classify -> store, returns the first stage. Scraped results
+    # ({'person', 'ext', 'posts', 'outcome'}) go in, close() it once they're
+    # all in. outcomes collects the outcomes per person.
+    prompts = wanted_prompts()
+    post_store = PostStore()
+    near_dupes = NearDupes()
+    # Posts on their way to the store, not in seen_posts yet
+    in_flight = set()
+
+    async def dedupe(result):
+        if visited_profiles is not None:
+            visited_profiles[result['person']] = datetime.datetime.now().strftime(
+                "%Y-%m-%d %H:%M:%S")
+        if revisit_stats is not None:
+            revisit.record_visit(revisit_stats, result)
+        if outcomes is not None:
+            outcomes.setdefault(result['person'], []).append(result['outcome'])
+        # Seen posts skip classifying but still get linked to this person
+        posts, seen = dedupe_posts(result['posts'], seen_posts, in_flight)
+        in_flight.update(post_urn(post) for post in posts)
+        # Reposts and cross-posts get stored pointing at the first copy and
+        # aren't classified on their own
+        metrics.record('near_duplicates', near_dupes.cluster(posts, post_urn))
+        return {'person': result['person'], 'ext': result['ext'], 'posts': posts, 'seen': seen,
+                'scraped': result}
+
+    async def classify(result):
+        if CLASSIFY:
+            topics = prompts.get(result['person'], [str(APPROVED_TOPICS)])
+            verdicts = await asyncio.gather(*[classify_post(post, prompt) for post in result['posts']
+                                              if 'post_text' in post and 'duplicate_of' not in post
+                                              for prompt in topics],
+                                            return_exceptions=True)
+            for verdict in verdicts:
+                if isinstance(verdict, Exception):
+                    print(verdict)
+                    metrics.record('classify_errors', 1)
+        return result
+
+    async def store(result):
+        # Only the delta gets stored, seen posts just get a link (a no-op
+        # when it's there already). Posts are seen once they're stored, a
+        # failed write or a crash before it gets them scraped and classified
+        # again.
+        keys = [post_urn(post) for post in result['posts']]
+        scraped_at = time.time()
+        try:
+            # Linked first, so the new posts above them on the page read first
+            if result['seen']:
+                post_store.link(result['person'], result['ext'], result['seen'], scraped_at)
+            if result['posts']:
+                post_store.add(result['person'], result['ext'], result['posts'], scraped_at)
+        finally:
+            in_flight.difference_update(keys)
+        for key in keys:
+            seen_posts.add(key)
+        seen_posts.flush()
+        # The watermark moves once the posts are safe, after a failed write
+        # the next scrape has to go past it again
+        if watermarks is not None:
+            update_watermark(watermarks, result['scraped'])
+        metrics.record('posts_stored', len(result['posts']))
+
+    store_stage = Stage('store', store, maxsize=PIPELINE_QUEUE_SIZE)
+    classify_stage = Stage('classify', classify, workers=CLASSIFY_WORKERS, maxsize=PIPELINE_QUEUE_SIZE,
+                           next_stage=store_stage)
+    return Stage('dedupe', dedupe, maxsize=PIPELINE_QUEUE_SIZE, next_stage=classify_stage)
+
 # SERVER START
 
 
@@ -235,115 +436,152 @@ def start_flask_server():
 # SCRAPING
 
 
-rate_limiter = Limiter(1/5)
-
-
 async def scrape_feed(browser, username, saved_keys, blacklist):
     context = await browser.new_context()
+    blocked = await block_resources(context, BLOCKING)
     page = await context.new_page()
     await stealth_async(page)
-    await page.goto('https://www.linkedin.com/feed/', timeout=60000)
-
-    await load_cookies(context, username)
-    if not page.url.startswith('https://www.linkedin.com/feed'):
-        print("Cookies invalid, logging in...")
-        # Replace securely
-        await login_and_get_cookies(page, username, config['credentials'][username.split('@')[0]])
-        await page.goto('https://www.linkedin.com/feed/', timeout=60000)
-
-    posts, saved_keys = await fetch_posts(page, saved_keys, blacklist)
+    with capture_voyager(page) as captured:
+        await page.goto(LINKEDIN_URL + '/feed/', timeout=60000)
+
+        await load_cookies(context, username)
+        if not page.url.startswith(LINKEDIN_URL + '/feed'):
+            print("Cookies invalid, logging in...")
+            # Replace securely
+            await login_and_get_cookies(page, username, config['credentials'][username.split('@')[0]])
+            captured.clear()
+            await page.goto(LINKEDIN_URL + '/feed/', timeout=60000)
+
+        posts, saved_keys = await fetch_posts(page, saved_keys, blacklist, captured)
+        if RECORD:
+            await record_snapshot(page, 'feed', '.scaffold-finite-scroll__content')
     # links = await scrape_link_only(page, posts, "//*[@data-finite-scroll-hotkey-item]")
+    record_blocked(blocked)
     await context.close()
     return posts, saved_keys
 
 
-async def scrape_person(browser, person, extension, saved_keys, blacklist, sem, username):
-    async with sem:
-        await rate_limiter.wait()
-        context = await browser.new_context()
-        try:
-            await load_cookies(context, username)
-
-            page = await context.new_page()
-            # await stealth_async(page)
-            url = f'https://www.linkedin.com/in/{person}/recent-activity/{extension}'
-            await page.goto(url, timeout=90000)
-            posts, saved_keys = await fetch_posts_person(page, person, extension, saved_keys, blacklist)
+async def scrape_person(pool, limiter, person, extension, saved_keys, blacklist, watermark=()):
+    url = f'{LINKEDIN_URL}/in/{person}/recent-activity/{extension}'
+    # Posts yielded before a failure are already in saved_keys, keep them
+    posts = []
+    try:
+        async with limiter.slot() as result:
+            async with pool.lease() as page:
+                with capture_voyager(page) as captured:
+                    start = time.monotonic()
+                    response = await page.goto(url, timeout=90000)
+                    result['latency'] = time.monotonic() - start
+                    result['outcome'] = page_outcome(response, page.url)
+                    if result['outcome'] != 'ok':
+                        print(f"{result['outcome']}: {url}")
+                        return {'posts': posts, 'person': person, 'ext': extension, 'outcome': result['outcome']}
+                    async for post in fetch_posts_person(page, person, extension, saved_keys, blacklist,
+                                                         watermark=watermark,
+                                                         max_scrolls=config['settings'].get('max_scrolls', 10),
+                                                         captured=captured):
+                        posts.append(post)
+                if RECORD:
+                    await record_snapshot(page, f'in/{person}/recent-activity/{extension}')
         # links = await scrape_link_only(page, posts, "./ul[1]/li")
-            await context.close()
-            return {'posts': posts, 'ext': extension}
-        except Exception as e:
-            print(e)
-            print(page.url)
-            await context.close()
-            return {'posts': [], 'ext': extension}
+        return {'posts': posts, 'person': person, 'ext': extension, 'outcome': 'ok'}
+    except Exception as e:
+        print(e)
+        print(url)
+        return {'posts': posts, 'person': person, 'ext': extension, 'outcome': 'failed'}
 
 
-async def main(taskQueue: Queue):
-    # saved_keys = load_visited_posts()
+async def main(job_queue: JobQueue):
     saved_keys = set()
 
     blacklist = config['blacklist']
     extensions = config['extensions']
 
     visited_profiles = get_visited_profiles()
+    watermarks = load_watermarks()
+    revisit_stats = revisit.load_stats()
+    people = job_queue.lease()
+    outcomes = {}
+    # Most expected new posts per page load first, quiet pages wait
+    due = revisit.frontier(revisit_stats, [(person, extension) for person in people for extension in extensions],
+                           MIN_EXPECTED_POSTS)
+    if not due:
+        # Every page is recent enough, no browser needed
+        settle_jobs(job_queue, people, due, outcomes)
+        return
+    if not refresh_quotas():
+        # Nothing can scrape before an account gets its uses back, the jobs
+        # wait for that instead of starting chromium every RETRY_SECONDS
+        delay = next_quota_reset()
+        delay = RETRY_SECONDS if delay is None else max(delay, RETRY_SECONDS)
+        print(f"No account has uses left, the jobs wait {int(delay)} seconds")
+        job_queue.release(people, delay)
+        return
 
-    sem = asyncio.Semaphore(2)
+    workers = config['settings'].get('workers', 1)
+    if workers > 1:
+        # Each worker process gets its own chromium and a slice of the accounts
+        from scrape_farm import run_farm
+
+        print(datetime.datetime.now())
+        jobs = [(person, extension, sorted(watermark_for(watermarks, person, extension)))
+                for person, extension in due]
+        remaining = await run_farm(jobs, workers, visited_profiles, watermarks, revisit_stats, outcomes)
+        save_visited_profiles(visited_profiles)
+        save_watermarks(watermarks)
+        revisit.save_stats(revisit_stats)
+        settle_jobs(job_queue, people, due, outcomes)
+        await save_profile_counts(remaining)
+        metrics.print_summary()
+        print(datetime.datetime.now())
+        return
+
+    lag_watch = asyncio.create_task(metrics.watch_loop_lag())
     async with async_playwright() as p:
         print(datetime.datetime.now())
         browser = await p.chromium.launch(headless=True)
         # posts, saved_keys = await scrape_feed(browser, saved_keys, blacklist)
 
-        remaining_calls, curr_username = await load_new_account(browser)
-        if remaining_calls == -1:
-            await browser.close()
-            return
-
-        tasks = []
-        visited = set()
-        while not taskQueue.empty():
-            new_block = taskQueue.get()
-            for person in new_block['stalklist']:
-                if visited_profiles.get(person) and (datetime.datetime.now() - datetime.datetime.strptime(visited_profiles[person], '%Y-%m-%d %H:%M:%S')).total_seconds()//(3600) < 12:
-                    print((datetime.datetime.now() - datetime.datetime.strptime(
-                        visited_profiles[person], '%Y-%m-%d %H:%M:%S')).total_seconds()//(3600))
-                    continue
-                if remaining_calls == -1:
-                    break
-
-                visited_profiles[person] = datetime.datetime.now().strftime(
-                    "%Y-%m-%d %H:%M:%S")
-                for extension in extensions:
-                    tasks += [asyncio.create_task(scrape_person(
-                        browser, person, extension, saved_keys, blacklist, sem, curr_username))]
-                    remaining_calls -= 1
-                    if remaining_calls <= 0:
-                        remaining_calls, curr_username = await load_new_account(browser)
-
-                # for extension in extensions:
-                # tasks += await scrape_person(browser, person, extension, saved_keys, blacklist)
-
-                results = await asyncio.gather(*tasks)
-                out = []
-
-                for result in results:
-                    for post in result['posts']:
-
-                        if (post['data_id']) and (not post['data_id'] in visited):
-                            out.append(post)
-                            visited.add(post['data_id'])
+        # Every account with uses left works at the same time
+        quotas = refresh_quotas()
+        await login_accounts(browser, quotas)
+        scheduler = make_scheduler(browser, quotas)
+
+        # scrape -> dedupe -> classify -> store with bounded queues between
+        # them, parsing happens inside the scrape stage (or the parse pool).
+        # The scrape stage runs up to twice the accounts' combined
+        # concurrency ceiling, and every result moves on as soon as it's in.
+        window = 2 * sum(int(account['limiter'].max_concurrency) for account in scheduler.accounts.values())
+        seen_posts = SeenPosts()
+
+        async def scrape(job):
+            person, extension = job
+            # None when no account had uses left
+            return await scheduler.run(scrape_person, person, extension, saved_keys, blacklist,
+                                       watermark_for(watermarks, person, extension))
+
+        scrape_stage = Stage('scrape', scrape, workers=window, maxsize=window,
+                             next_stage=make_pipeline(seen_posts, visited_profiles, watermarks, revisit_stats, outcomes))
+        # As many of the best pages as the accounts have uses for
+        for job in due[:scheduler.remaining()]:
+            await scrape_stage.put(job)
+        await scrape_stage.close()
+        seen_posts.close()
 
-            # out = posts + out
-            # out = await process_posts(out)
-                save_to_json(out, person)
         save_visited_profiles(visited_profiles)
-        await save_profile_counts(remaining_calls)
+        save_watermarks(watermarks)
+        revisit.save_stats(revisit_stats)
+        settle_jobs(job_queue, people, due, outcomes)
+        await save_profile_counts({name: account['remaining'] for name, account in scheduler.accounts.items()})
+        await scheduler.close()
         await browser.close()
+    lag_watch.cancel()
+    metrics.print_summary()
     print(datetime.datetime.now())
     # start_flask_server()
 
 
 if __name__ == "__main__":
-    q = Queue()
-    q.put({"stalklist": ["kevinolearytv", "williamhgates", "mattgray1"]})
-    asyncio.run(main(q))
+    job_queue = JobQueue()
+    job_queue.enqueue(["kevinolearytv", "williamhgates", "mattgray1"])
+    asyncio.run(main(job_queue))
@@ -0,0 +1,141 @@
+import hashlib
+import math
+import sqlite3
+import time
+
+# Every post the scraper has seen, as a 64 bit hash of its urn (or text key
+# for posts without one), in SQLite with the time it was first seen. A Bloom
+# filter kept next to the hashes answers most "not seen" checks without a
+# query, only maybe-seen posts hit the index. flush() writes the new hashes
+# and pulls in the ones other scraper processes added since, so filters of
+# concurrent processes catch up with each other. Hashes older than the ttl
+# are dropped by compact(), which rebuilds the filter.
+
+SEEN_FILE = 'seen_posts.db'
+TTL_DAYS = 180
+COMPACT_EVERY = 24 * 3600
+BLOOM_CAPACITY = 1000000
+BLOOM_ERROR_RATE = 0.01
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS seen (
+    id INTEGER PRIMARY KEY,
+    hash INTEGER NOT NULL UNIQUE,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seen_time ON seen (seen_at);
+CREATE TABLE IF NOT EXISTS bloom (
+    name TEXT PRIMARY KEY,
+    bits BLOB NOT NULL,
+    capacity INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    compacted_at REAL NOT NULL
+);
+'''
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE, bits=None):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def positions(self, hash):
+        # Double hashing on the two halves of the 64 bit hash
+        low, high = hash & 0xffffffff, (hash >> 32) & 0xffffffff
+        return [(low + i * high) % self.size for i in range(self.hashes)]
+
+    def add(self, hash):
+        for position in self.positions(hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(hash))
+
+
+class SeenPosts:
+    # Set-like, `key in seen_posts` and seen_posts.add(key) with post keys.
+    # Adds are kept in memory until flush().
+
+    def __init__(self, path=SEEN_FILE, ttl_days=TTL_DAYS, capacity=BLOOM_CAPACITY):
+        self.ttl = ttl_days * 24 * 3600
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.pending = {}
+
+        row = self.db.execute("SELECT * FROM bloom WHERE name = 'seen'").fetchone()
+        if row is None:
+            self.generation, self.compacted_at = 0, time.time()
+            self.rebuild(capacity)
+        else:
+            bits, capacity, self.count, self.last_id, self.generation, self.compacted_at = row[1:]
+            self.bloom = BloomFilter(capacity, bits=bits)
+            self.catch_up()
+
+    def rebuild(self, capacity):
+        count = self.db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        self.bloom = BloomFilter(max(capacity, 2 * count))
+        self.count = 0
+        self.last_id = 0
+        self.catch_up()
+
+    def catch_up(self):
+        # Hashes other processes added since this filter last looked
+        for id, hash in self.db.execute('SELECT id, hash FROM seen WHERE id > ? ORDER BY id', (self.last_id,)):
+            self.bloom.add(hash)
+            self.count += 1
+            self.last_id = id
+
+    def __contains__(self, key):
+        hash = key_hash(key)
+        if hash in self.pending:
+            return True
+        if hash not in self.bloom:
+            return False
+        return self.db.execute('SELECT 1 FROM seen WHERE hash = ?', (hash,)).fetchone() is not None
+
+    def add(self, key):
+        self.pending[key_hash(key)] = time.time()
+
+    def flush(self):
+        if self.pending:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('INSERT OR IGNORE INTO seen (hash, seen_at) VALUES (?, ?)', self.pending.items())
+            self.db.execute('COMMIT')
+            self.pending = {}
+        self.catch_up()
+        if self.count > self.bloom.capacity:
+            # Past capacity the false positive rate climbs, start a bigger one
+            self.rebuild(2 * self.bloom.capacity)
+
+    def compact(self):
+        # Forgets posts first seen more than ttl ago, the filter can't drop
+        # single hashes so it gets rebuilt
+        self.compacted_at = time.time()
+        self.generation += 1
+        self.db.execute('DELETE FROM seen WHERE seen_at < ?', (self.compacted_at - self.ttl,))
+        self.rebuild(self.bloom.capacity)
+
+    def close(self):
+        self.flush()
+        if time.time() - self.compacted_at > COMPACT_EVERY:
+            self.compact()
+        self.db.execute('BEGIN IMMEDIATE')
+        row = self.db.execute("SELECT last_id, generation FROM bloom WHERE name = 'seen'").fetchone()
+        # Only a filter at least as new as the stored one replaces it, one
+        # built before the last compaction would bring back dropped hashes
+        if row is None or (self.generation >= row[1] and self.last_id >= row[0]):
+            self.db.execute('INSERT OR REPLACE INTO bloom VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            ('seen', bytes(self.bloom.bits), self.bloom.capacity, self.count, self.last_id,
+                             self.generation, self.compacted_at))
+        self.db.execute('COMMIT')
+        self.db.close()
@@ -0,0 +1,39 @@
+import sqlite3
+from contextlib import contextmanager
+
+# The SQLite files the flask server and the scraper processes share (jobs,
+# posts, near duplicates). They're in WAL mode, so reads go on while a
+# process writes. Writes take the write lock up front (BEGIN IMMEDIATE), a
+# read-then-write transaction can't lose the upgrade to another writer.
+# Reads take no lock and see the last commit.
+
+
+def open_db(path, schema):
+    db = sqlite3.connect(path, timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(schema)
+    db.close()
+
+
+@contextmanager
+def connect(path, row_factory=None):
+    # Autocommit, every statement is its own (deferred) transaction
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.row_factory = row_factory
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def transaction(path, row_factory=None):
+    with connect(path, row_factory) as db:
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            yield db
+            db.execute('COMMIT')
+        except BaseException:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
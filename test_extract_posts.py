@@ -0,0 +1,26 @@
+import asyncio
+import os
+
+import pytest
+
+playwright = pytest.importorskip('playwright.sync_api')
+
+from benchmark_scrape import check_browser_parity, load_fixture, make_person_page
+
+# The bundled js extractor against the html.parser path on the same activity
+# page, in a real Chromium. Needs `playwright install chromium`, skipped
+# without it.
+
+
+def chromium_installed():
+    try:
+        with playwright.sync_playwright() as p:
+            return os.path.exists(p.chromium.executable_path)
+    except Exception:
+        return False
+
+
+@pytest.mark.skipif(not chromium_installed(), reason='Chromium not installed (playwright install chromium)')
+def test_extractor_matches_html_parser():
+    same, _ = asyncio.run(check_browser_parity(make_person_page(load_fixture('pom.html'))))
+    assert same
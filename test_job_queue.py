@@ -0,0 +1,121 @@
+import pytest
+
+import job_queue
+from job_queue import JobQueue, LEASE_SECONDS, MAX_ATTEMPTS, RETRY_SECONDS
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def jobs(tmp_path, clock):
+    return JobQueue(str(tmp_path / 'jobs.db'))
+
+
+def test_lease_highest_priority_first(jobs):
+    jobs.enqueue(['a'])
+    jobs.enqueue(['b'], priority=5)
+    assert jobs.lease() == ['b', 'a']
+    assert jobs.lease() == []
+    assert jobs.status()['a']['status'] == 'leased'
+    assert jobs.status()['a']['attempts'] == 1
+
+
+def test_lease_limit(jobs):
+    jobs.enqueue(['a', 'b', 'c'])
+    assert len(jobs.lease(limit=2)) == 2
+    assert len(jobs.lease()) == 1
+
+
+def test_expired_lease_is_leased_again(jobs, clock):
+    jobs.enqueue(['a'])
+    assert jobs.lease() == ['a']
+    clock.now += LEASE_SECONDS - 1
+    assert jobs.lease() == []
+    clock.now += 1
+    assert jobs.lease() == ['a']
+    assert jobs.status()['a']['attempts'] == 2
+
+
+def test_expired_leases_stop_at_max_attempts(jobs, clock):
+    jobs.enqueue(['a'])
+    for _ in range(MAX_ATTEMPTS):
+        assert jobs.lease() == ['a']
+        clock.now += LEASE_SECONDS
+    assert jobs.lease() == []
+    status = jobs.status()['a']
+    assert status['status'] == 'failed'
+    assert status['attempts'] == MAX_ATTEMPTS
+    assert jobs.next_due() is None
+
+
+def test_fail_backs_off(jobs, clock):
+    jobs.enqueue(['a'])
+    for attempt in range(1, MAX_ATTEMPTS):
+        assert jobs.lease() == ['a']
+        jobs.fail('a', 'timeout')
+        delay = RETRY_SECONDS * 2 ** (attempt - 1)
+        assert jobs.status()['a']['available_at'] == clock.now + delay
+        clock.now += delay - 1
+        assert jobs.lease() == []
+        clock.now += 1
+    assert jobs.lease() == ['a']
+    jobs.fail('a', 'timeout')
+    status = jobs.status()['a']
+    assert status['status'] == 'failed'
+    assert status['error'] == 'timeout'
+
+
+def test_release_keeps_the_attempt(jobs, clock):
+    jobs.enqueue(['a'])
+    jobs.lease()
+    jobs.release(['a'], delay=10)
+    status = jobs.status()['a']
+    assert status['status'] == 'queued'
+    assert status['attempts'] == 0
+    assert jobs.lease() == []
+    clock.now += 10
+    assert jobs.lease() == ['a']
+
+
+def test_release_only_leased_jobs(jobs):
+    jobs.enqueue(['a'])
+    jobs.lease()
+    jobs.complete(['a'])
+    jobs.release(['a'])
+    assert jobs.status()['a']['status'] == 'done'
+
+
+def test_enqueue_while_leased_raises_priority(jobs):
+    jobs.enqueue(['a'])
+    jobs.lease()
+    jobs.enqueue(['a'], priority=3)
+    status = jobs.status()['a']
+    assert status['status'] == 'leased'
+    assert status['priority'] == 4
+    assert status['attempts'] == 1
+    assert jobs.lease() == []
+
+
+def test_enqueue_after_done_queues_again(jobs):
+    jobs.enqueue(['a'], priority=3)
+    jobs.lease()
+    jobs.complete(['a'])
+    jobs.enqueue(['a'])
+    status = jobs.status()['a']
+    assert status['status'] == 'queued'
+    assert status['priority'] == 1
+    assert status['attempts'] == 0
+    assert jobs.lease() == ['a']